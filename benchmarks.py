@@ -0,0 +1,257 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from tempfile import TemporaryDirectory
+from datetime import datetime
+from timeit import Timer
+from time import perf_counter
+from re import compile as regex
+import downdrag
+import outputs
+import json
+import logging
+import os
+import platform
+
+BENCHMARK_HOST = '127.0.0.1'
+BENCHMARK_CONFIG_FILENAME = 'downdrag.yml'
+BENCHMARK_METRICS_FILENAME = 'metrics.json'
+BENCHMARK_QUEUE_FILENAME = 'queue.db'
+DEFAULT_PROFILES = 2
+DEFAULT_PAGES = 5
+DEFAULT_ITEMS = 20
+DEFAULT_SIZE = 4096
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PROCESSES = 0
+DEFAULT_WORKERS = 1
+DEFAULT_REPEAT = 5
+DEFAULT_NUMBER = 10000
+DEFAULT_ROWS = 10000
+FIXTURE_LISTING = '<html><head><title>%s</title></head><body><div id="items">%s</div>%s</body></html>'
+FIXTURE_LISTING_ITEM = '<div class="item"><a href="/%s/item/%i/%i">Item %i-%i</a><span class="summary">Summary of item %i-%i</span></div>'
+FIXTURE_LISTING_NEXT = '<a class="next" href="/%s/list/%i">next</a>'
+FIXTURE_DETAIL = """<html><head><title>Item %i-%i</title><style>p{margin:0}</style></head><body>
+<div class="name">  Item %i-%i  </div>
+<div class="feat">Color: %s</div>
+<div class="feat">Size: %ix%i</div>
+<div class="feat">Delivery: %i:30AM to %iPM</div>
+<div id="filler">%s</div>
+</body></html>"""
+FIXTURE_SCHEDULE = '<html><body><div id="schedules">%s</div></body></html>'
+FIXTURE_FILLER = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>'
+FIXTURE_COLORS = ['red', 'green', 'blue']
+BENCHMARK_DETAILS = {
+  'color': {'type': 'string', 'conversion': {'process': 'value', 'pattern': '^(red|green|blue)'}},
+  'size': {'default': 8, 'type': 'int', 'conversion': {'process': 'calculate', 'pattern': r'\b(\d+)x(\d+)\b', 'formula': '%s*%s'}},
+  'lot': {'type': 'float', 'conversion': {'process': 'layer', 'formula': 'size*23.5'}},
+  'delivery': {'conversion': {'process': 'schedule', 'pattern': r'(\d+(?::\d+)?[AP]M) to (\d+(?::\d+)?[AP]M)'}}
+}
+BENCHMARK_HEADERS = ['itemindex', 'source', 'index', 'name', 'description', 'extrainfo', 'link', 'size', 'lot']
+BENCHMARK_TYPES = ['int', 'string', 'int', 'string', 'string', 'string', 'string', 'int', 'float']
+BENCHMARK_WRITERS = {
+  'csv': lambda directory: outputs.CsvResultsWriter({outputs.KEY_CSV_FILENAME: os.path.join(directory, 'results.csv')}, BENCHMARK_HEADERS),
+  'csv.gz': lambda directory: outputs.CsvResultsWriter({outputs.KEY_CSV_FILENAME: os.path.join(directory, 'results.csv.gz')}, BENCHMARK_HEADERS),
+  'html': lambda directory: outputs.HtmlResultsWriter({outputs.KEY_HTML_FILENAME: os.path.join(directory, 'results.html'), outputs.KEY_HTML_TITLE: 'benchmark'}, BENCHMARK_HEADERS),
+  'sqlite': lambda directory: outputs.SqliteResultsWriter({outputs.KEY_SQLITE_FILENAME: os.path.join(directory, 'results.db'), outputs.KEY_SQLITE_TABLENAME: 'results'}, BENCHMARK_HEADERS, BENCHMARK_TYPES),
+  'parquet': lambda directory: outputs.ParquetResultsWriter({outputs.KEY_PARQUET_FILENAME: os.path.join(directory, 'results.parquet')}, BENCHMARK_HEADERS, BENCHMARK_TYPES)
+}
+
+class FixtureSite(object):
+  def __init__(self, profiles, pages, items, size):
+    self.profiles = ['profile%i' % profile for profile in range(profiles)]
+    self.pages = pages
+    self.items = items
+    self.filler = FIXTURE_FILLER * max(1, size // len(FIXTURE_FILLER))
+  def __enter__(self):
+    site = self
+    class FixtureHandler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      def log_message(self, format, *args):
+        pass
+      def do_GET(self):
+        content = site.render(self.path.strip('/').split('/'))
+        if content is None:
+          self.send_response(404)
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+          return
+        content = content.encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    self.server = ThreadingHTTPServer((BENCHMARK_HOST, 0), FixtureHandler)
+    self.server.daemon_threads = True
+    Thread(target=self.server.serve_forever, daemon=True).start()
+    self.url = 'http://%s:%i' % (BENCHMARK_HOST, self.server.server_address[1])
+    return self
+  def __exit__(self, type, value, tb):
+    self.server.shutdown()
+    self.server.server_close()
+  def render(self, parts):
+    if parts == ['schedule']:
+      return FIXTURE_SCHEDULE % ''.join('<p>%s</p>' % line for line in self.schedule())
+    if len(parts) < 3 or parts[0] not in self.profiles: return None
+    profile, kind = parts[0], parts[1]
+    try: numbers = [int(part) for part in parts[2:]]
+    except ValueError: return None
+    if kind == 'list' and len(numbers) == 1 and numbers[0] < self.pages:
+      page = numbers[0]
+      items = ''.join(FIXTURE_LISTING_ITEM % (profile, page, item, page, item, page, item) for item in range(self.items))
+      pager = FIXTURE_LISTING_NEXT % (profile, page + 1) if page + 1 < self.pages else ''
+      return FIXTURE_LISTING % (profile, items, pager)
+    if kind == 'item' and len(numbers) == 2:
+      page, item = numbers
+      return FIXTURE_DETAIL % (page, item, page, item, FIXTURE_COLORS[item % len(FIXTURE_COLORS)], item + 1, page + 2, 1 + item % 11, 1 + page % 11, self.filler)
+    return None
+  def schedule(self):
+    lines = []
+    for day in ['Monday', 'Tuesday', 'Wednesday']:
+      lines.append(day)
+      lines.extend('ITEM %i-%i %s' % (page, item, day.lower()) for page in range(self.pages) for item in range(0, self.items, 3))
+    return lines
+  def config(self, directory, concurrency, processes, workers):
+    profiles = {}
+    for index, profile in enumerate(self.profiles):
+      profiles[profile] = {
+        'url': '%s/%s/list/0' % (self.url, profile),
+        'pagers': '//a[@class="next"]',
+        'items': '//div[@class="item"]',
+        'name': '//div[@class="name"]/text()',
+        'features': '//div[@class="feat"]/text()',
+        'evaluator': r'^\s*\w+: (.+)\s*$'
+      }
+      if index % 2:
+        profiles[profile]['pathfinder'] = {'target': 'index', 'value': 'span/text()'}
+      else:
+        profiles[profile]['pathfinder'] = {'target': 'external', 'link': '%s/schedule' % self.url, 'type': 'fulltext', 'pattern': '^(Monday|Tuesday|Wednesday)$', 'format': 'list', 'indexer': 'startswith', 'value': '//div[@id="schedules"]/p/text()'}
+    config = {
+      'querier': {'mode': 'plain', 'cached': True, 'concurrency': concurrency},
+      'outputs': {
+        'csv': {'filename': os.path.join(directory, 'results.csv')},
+        'html': {'filename': os.path.join(directory, 'results.html'), 'title': 'benchmark'}
+      },
+      'pipeline': {'processes': processes},
+      'metrics': {'filename': os.path.join(directory, BENCHMARK_METRICS_FILENAME)},
+      'details': BENCHMARK_DETAILS,
+      'profiles': profiles
+    }
+    if workers > 1:
+      config['shards'] = {'filename': os.path.join(directory, BENCHMARK_QUEUE_FILENAME), 'workers': workers, 'split': list(profiles)}
+    return config
+
+def benchmarkrun(profiles, pages, items, size, concurrency, processes, workers):
+  from confuse import Configuration
+  import yaml
+  with TemporaryDirectory() as directory, FixtureSite(profiles, pages, items, size) as site:
+    configfilename = os.path.join(directory, BENCHMARK_CONFIG_FILENAME)
+    with open(configfilename, 'w', encoding='utf8') as configfile:
+      yaml.safe_dump(site.config(directory, concurrency, processes, workers), configfile)
+    config = Configuration(downdrag.APPLICATION_NAME, read=False)
+    config.set_file(configfilename)
+    started = perf_counter()
+    downdrag.execute(config.get())
+    elapsed = perf_counter() - started
+    with open(os.path.join(directory, BENCHMARK_METRICS_FILENAME), 'r', encoding='utf8') as metricsfile:
+      metrics = json.load(metricsfile)
+  return {
+    'parameters': {'profiles': profiles, 'pages': pages, 'items': items, 'size': size, 'concurrency': concurrency, 'processes': processes, 'workers': workers},
+    'seconds': elapsed,
+    'items': metrics['items'],
+    'itemspersecond': metrics['items'] / elapsed if elapsed else 0.0,
+    'peakrss': peakrss(),
+    'stages': {stage: {'seconds': sum(entry['seconds'] for entry in labels.values()), 'count': sum(entry['count'] for entry in labels.values())} for stage, labels in metrics['stages'].items()},
+    'cache': metrics.get('cache', {})
+  }
+
+def benchmarkhelpers(repeat, number):
+  schedule = regex(BENCHMARK_DETAILS['delivery']['conversion']['pattern'])
+  match = schedule.search('Delivery: 9:30PM to 2AM')
+  nodes = ['  line %i of the schedule  ' % line for line in range(20)]
+  detailvalues = {'color': 'red', 'size': 12, 'lot': 282.0}
+  helpers = {
+    'parseTimevalue': lambda: downdrag.parseTimevalue('9:30PM', 8),
+    'parseschedule': lambda: downdrag.parseschedule(match, 8),
+    'calculatelayer': lambda: downdrag.calculatelayer('size*23.5', detailvalues),
+    'cleantextnodes': lambda: downdrag.cleantextnodes(nodes)
+  }
+  results = {}
+  for name, helper in helpers.items():
+    timings = Timer(helper).repeat(repeat, number)
+    results[name] = {'best': min(timings) / number, 'mean': sum(timings) / len(timings) / number}
+  return results
+
+def benchmarkwriters(repeat, rows):
+  results = {}
+  for name, create in BENCHMARK_WRITERS.items():
+    timings = []
+    try:
+      for attempt in range(repeat):
+        with TemporaryDirectory() as directory:
+          started = perf_counter()
+          with create(directory) as writer:
+            for index in range(rows):
+              writer.start_item(index)
+              writer.write_string('profile%i' % (index % 2))
+              writer.write_int(index)
+              writer.write_string('Item %i' % index)
+              writer.write_string('red,%ix%i,"quoted" <b>' % (index % 7, index % 5))
+              writer.write_string('')
+              writer.write_string('http://%s/item/%i' % (BENCHMARK_HOST, index))
+              writer.write_int(index % 35)
+              writer.write_float(index * 23.5)
+              writer.end_item()
+          timings.append(perf_counter() - started)
+    except ImportError as exc:
+      results[name] = {'skipped': str(exc)}
+      continue
+    results[name] = {'best': min(timings) / rows, 'rowspersecond': rows / min(timings)}
+  return results
+
+def peakrss():
+  try: from resource import getrusage, RUSAGE_SELF
+  except ImportError: return None
+  peak = getrusage(RUSAGE_SELF).ru_maxrss
+  return peak if platform.system() == 'Darwin' else peak * 1024
+
+def compareresults(previous, current, path=''):
+  for key, value in current.items():
+    if key not in previous or key == 'parameters': continue
+    if isinstance(value, dict) and isinstance(previous[key], dict):
+      compareresults(previous[key], value, '%s%s.' % (path, key))
+    elif isinstance(value, (int, float)) and isinstance(previous[key], (int, float)) and previous[key]:
+      print('%s%s: %.6g -> %.6g (%+.1f%%)' % (path, key, previous[key], value, (value / previous[key] - 1) * 100))
+
+if __name__ == "__main__":
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description='Offline benchmarks of %s' % downdrag.APPLICATION_NAME)
+  parser.add_argument('--profiles', type=int, default=DEFAULT_PROFILES)
+  parser.add_argument('--pages', type=int, default=DEFAULT_PAGES)
+  parser.add_argument('--items', type=int, default=DEFAULT_ITEMS)
+  parser.add_argument('--size', type=int, default=DEFAULT_SIZE)
+  parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+  parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+  parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+  parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+  parser.add_argument('--number', type=int, default=DEFAULT_NUMBER)
+  parser.add_argument('--rows', type=int, default=DEFAULT_ROWS)
+  parser.add_argument('--output', help='JSON file of the results')
+  parser.add_argument('--compare', help='JSON file of previous results to compare with')
+  arguments = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+  results = {
+    'started': datetime.now().isoformat(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'run': benchmarkrun(arguments.profiles, arguments.pages, arguments.items, arguments.size, arguments.concurrency, arguments.processes, arguments.workers),
+    'helpers': benchmarkhelpers(arguments.repeat, arguments.number),
+    'writers': benchmarkwriters(arguments.repeat, arguments.rows)
+  }
+  if arguments.output:
+    with open(arguments.output, 'w', encoding='utf8') as outputfile:
+      json.dump(results, outputfile, indent=2)
+  else:
+    print(json.dumps(results, indent=2))
+  if arguments.compare:
+    with open(arguments.compare, 'r', encoding='utf8') as comparefile:
+      compareresults(json.load(comparefile), results)
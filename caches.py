@@ -0,0 +1,204 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import time
+import gzip
+import json
+import logging
+import os
+
+KEY_CACHE_DIRECTORY = 'directory'
+KEY_CACHE_TTL = 'ttl'
+KEY_CACHE_MAXSIZE = 'maxsize'
+KEY_VALIDATOR_ETAG = 'etag'
+KEY_VALIDATOR_LASTMODIFIED = 'lastmodified'
+KEY_ENTRY_LINK = 'link'
+KEY_ENTRY_METHOD = 'method'
+KEY_ENTRY_DIGEST = 'digest'
+KEY_ENTRY_VALIDATORS = 'validators'
+KEY_ENTRY_FETCHED = 'fetched'
+KEY_ENTRY_ACCESSED = 'accessed'
+DISK_OBJECTS = 'objects'
+DISK_ENTRIES = 'entries'
+DISK_OBJECT_SUFFIX = '.gz'
+DISK_ENTRY_SUFFIX = '.json'
+LOGGING_CACHE_STATISTICS = 'cache %s statistics: %s'
+
+class ContentCache(ABC):
+  @abstractmethod
+  def lookup(self, method, link):
+    raise NotImplementedError
+  @abstractmethod
+  def store(self, method, link, content, validators):
+    raise NotImplementedError
+  @abstractmethod
+  def refresh(self, method, link):
+    raise NotImplementedError
+  def close(self):
+    pass
+  @staticmethod
+  def Create(cacheconfig, maxmemory=0):
+    if isinstance(cacheconfig, dict): return DiskContentCache(cacheconfig)
+    return MemoryContentCache(maxmemory)
+
+class LruStore(object):
+  def __init__(self, capacity, weigh=None):
+    self.capacity = capacity
+    self.__weigh = weigh if weigh else lambda value: 1
+    self.__values = OrderedDict()
+    self.__lock = Lock()
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+  def get(self, key):
+    with self.__lock:
+      if key not in self.__values:
+        self.misses += 1
+        return None
+      self.__values.move_to_end(key)
+      self.hits += 1
+      return self.__values[key][0]
+  def put(self, key, value):
+    weight = self.__weigh(value)
+    with self.__lock:
+      if key in self.__values:
+        self.size -= self.__values.pop(key)[1]
+      if self.capacity and weight > self.capacity: return
+      self.__values[key] = (value, weight)
+      self.size += weight
+      while self.capacity and self.size > self.capacity:
+        self.size -= self.__values.popitem(last=False)[1][1]
+        self.evictions += 1
+  def statistics(self):
+    with self.__lock:
+      return {
+        'entries': len(self.__values),
+        'size': self.size,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions
+      }
+
+class MemoryContentCache(ContentCache):
+  def __init__(self, maxmemory=0):
+    self.__cached_content = LruStore(maxmemory, len)
+  def lookup(self, method, link):
+    content = self.__cached_content.get((method, link))
+    if content is None: return None
+    return (content, {}, True)
+  def store(self, method, link, content, validators):
+    self.__cached_content.put((method, link), content)
+  def refresh(self, method, link):
+    pass
+  def close(self):
+    logging.info(LOGGING_CACHE_STATISTICS % ('content', str(self.__cached_content.statistics())))
+
+class DiskContentCache(ContentCache):
+  def __init__(self, cacheconfig):
+    self.directory = cacheconfig[KEY_CACHE_DIRECTORY]
+    self.ttl = int(cacheconfig[KEY_CACHE_TTL]) if KEY_CACHE_TTL in cacheconfig else 0
+    self.maxsize = int(cacheconfig[KEY_CACHE_MAXSIZE]) if KEY_CACHE_MAXSIZE in cacheconfig else 0
+    self.__lock = Lock()
+    self.__validated = set()
+    self.__accessed = {}
+    os.makedirs(os.path.join(self.directory, DISK_OBJECTS), exist_ok=True)
+    os.makedirs(os.path.join(self.directory, DISK_ENTRIES), exist_ok=True)
+  def lookup(self, method, link):
+    entry = self.__read_entry(method, link)
+    if entry is None: return None
+    try:
+      with gzip.open(self.__object_path(entry[KEY_ENTRY_DIGEST]), 'rb') as stored:
+        content = stored.read()
+    except OSError:
+      return None
+    fresh = (method, link) in self.__validated or (self.ttl > 0 and time() - entry[KEY_ENTRY_FETCHED] < self.ttl)
+    if self.maxsize > 0:
+      with self.__lock:
+        self.__accessed[(method, link)] = time()
+    return (content, entry[KEY_ENTRY_VALIDATORS], fresh)
+  def store(self, method, link, content, validators):
+    if isinstance(content, str): content = content.encode('utf8')
+    digest = sha256(content).hexdigest()
+    path = self.__object_path(digest)
+    if not os.path.exists(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      self.__replace(path, gzip.compress(content))
+    self.__validated.add((method, link))
+    now = time()
+    self.__write_entry(method, link, {
+      KEY_ENTRY_METHOD: method,
+      KEY_ENTRY_LINK: link,
+      KEY_ENTRY_DIGEST: digest,
+      KEY_ENTRY_VALIDATORS: validators,
+      KEY_ENTRY_FETCHED: now,
+      KEY_ENTRY_ACCESSED: now
+    })
+  def refresh(self, method, link):
+    entry = self.__read_entry(method, link)
+    if entry is None: return
+    self.__validated.add((method, link))
+    entry[KEY_ENTRY_FETCHED] = time()
+    self.__write_entry(method, link, entry)
+  def close(self):
+    if self.maxsize > 0:
+      self.persistaccesses()
+      self.evict()
+  def persistaccesses(self):
+    with self.__lock:
+      accessed, self.__accessed = self.__accessed, {}
+    for (method, link), when in accessed.items():
+      entry = self.__read_entry(method, link)
+      if entry is None or entry[KEY_ENTRY_ACCESSED] >= when: continue
+      entry[KEY_ENTRY_ACCESSED] = when
+      self.__write_entry(method, link, entry)
+  def evict(self):
+    entriesdirectory = os.path.join(self.directory, DISK_ENTRIES)
+    entries = []
+    for filename in os.listdir(entriesdirectory):
+      path = os.path.join(entriesdirectory, filename)
+      try:
+        with open(path, 'r', encoding='utf8') as stored:
+          entries.append((json.load(stored), path))
+      except (OSError, ValueError):
+        os.remove(path)
+    references = {}
+    for entry, path in entries:
+      references[entry[KEY_ENTRY_DIGEST]] = references.get(entry[KEY_ENTRY_DIGEST], 0) + 1
+    sizes = {}
+    for digest in references:
+      try: sizes[digest] = os.path.getsize(self.__object_path(digest))
+      except OSError: sizes[digest] = 0
+    total = sum(sizes.values())
+    entries.sort(key=lambda entry: entry[0][KEY_ENTRY_ACCESSED])
+    for entry, path in entries:
+      if total <= self.maxsize: break
+      os.remove(path)
+      digest = entry[KEY_ENTRY_DIGEST]
+      references[digest] -= 1
+      if references[digest] == 0:
+        try: os.remove(self.__object_path(digest))
+        except OSError: pass
+        total -= sizes[digest]
+  def __object_path(self, digest):
+    return os.path.join(self.directory, DISK_OBJECTS, digest[:2], digest + DISK_OBJECT_SUFFIX)
+  def __entry_path(self, method, link):
+    key = sha256(('%s %s' % (method, link)).encode('utf8')).hexdigest()
+    return os.path.join(self.directory, DISK_ENTRIES, key + DISK_ENTRY_SUFFIX)
+  def __read_entry(self, method, link):
+    try:
+      with open(self.__entry_path(method, link), 'r', encoding='utf8') as stored:
+        entry = json.load(stored)
+    except (OSError, ValueError):
+      return None
+    if entry[KEY_ENTRY_LINK] != link or entry[KEY_ENTRY_METHOD] != method: return None
+    return entry
+  def __write_entry(self, method, link, entry):
+    self.__replace(self.__entry_path(method, link), json.dumps(entry).encode('utf8'))
+  def __replace(self, path, data):
+    with self.__lock:
+      temporary = '%s.%i.tmp' % (path, os.getpid())
+      with open(temporary, 'wb') as stored:
+        stored.write(data)
+      os.replace(temporary, path)
@@ -0,0 +1,61 @@
+from hashlib import sha256
+import json
+import os
+
+KEY_CONFIGCACHE_DIGEST = 'digest'
+KEY_CONFIGCACHE_USERCONFIG = 'userconfig'
+KEY_CONFIGCACHE_CONFIG = 'config'
+CONFIG_CACHE_SUFFIX = '.cache'
+CONFIG_CACHE_ENVIRONMENT = ['HOME', 'APPDATA', 'XDG_CONFIG_HOME', 'XDG_CONFIG_DIRS']
+
+def loadconfig(appname, configfilename, schemafilename):
+  cachefilename = configfilename + CONFIG_CACHE_SUFFIX
+  cached = readcache(cachefilename)
+  try:
+    if cached[KEY_CONFIGCACHE_DIGEST] == configdigest(appname, configfilename, schemafilename, cached[KEY_CONFIGCACHE_USERCONFIG]):
+      return cached[KEY_CONFIGCACHE_CONFIG]
+  except (TypeError, KeyError):
+    pass
+  from yamale import make_schema, make_data, validate
+  from confuse import Configuration
+  validate(make_schema(schemafilename), make_data(configfilename))
+  configuration = Configuration(appname)
+  configuration.set_file(configfilename)
+  config = configuration.get()
+  userconfig = configuration.user_config_path()
+  try:
+    if json.loads(json.dumps(config)) != config: return config
+    writecache(cachefilename, {
+      KEY_CONFIGCACHE_DIGEST: configdigest(appname, configfilename, schemafilename, userconfig),
+      KEY_CONFIGCACHE_USERCONFIG: userconfig,
+      KEY_CONFIGCACHE_CONFIG: config
+    })
+  except (TypeError, ValueError, OSError):
+    pass
+  return config
+
+def configdigest(appname, configfilename, schemafilename, userconfig):
+  digest = sha256()
+  for name in CONFIG_CACHE_ENVIRONMENT + ['%sDIR' % appname.upper()]:
+    digest.update(('%s=%s\n' % (name, os.environ.get(name, ''))).encode('utf8'))
+  for filename in [configfilename, schemafilename, userconfig]:
+    digest.update(('%s\n' % filename).encode('utf8'))
+    try:
+      with open(filename, 'rb') as hashed:
+        digest.update(hashed.read())
+    except OSError:
+      digest.update(b'\0')
+  return digest.hexdigest()
+
+def readcache(cachefilename):
+  try:
+    with open(cachefilename, 'r', encoding='utf8') as cachefile:
+      return json.load(cachefile)
+  except (OSError, ValueError):
+    return None
+
+def writecache(cachefilename, cached):
+  temporary = '%s.%i.tmp' % (cachefilename, os.getpid())
+  with open(temporary, 'w', encoding='utf8') as cachefile:
+    json.dump(cached, cachefile)
+  os.replace(temporary, cachefilename)
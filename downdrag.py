@@ -1,7 +1,16 @@
-from re import search, match as test, IGNORECASE, DOTALL
+from re import compile as regex, IGNORECASE, DOTALL
+from lxml.etree import XPath, tostring
 from datetime import datetime
-from querier import DataQuerier
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from contextlib import ExitStack, nullcontext
+from hashlib import sha1
+from functools import lru_cache
+from itertools import islice
+from time import sleep
+from querier import DataQuerier, parsecontent, KEY_QUERIER_CONCURRENCY, KEY_QUERIER_MODE, KEY_QUERIER_LEAN, KEY_CONTAINER, KEY_URL, KEY_PAGERS, QUERIER_PLAIN, QUERIER_DYNAMIC
 from outputs import ResultsWriterFactory
+from states import ScrapeState, STATE_UNCHANGED
 import logging
 
 APPLICATION_NAME = 'downdrag'
@@ -21,8 +30,18 @@ KEY_PROFILES = 'profiles'
 KEY_SCRAPE_TARGET = 'scrape_target'
 KEY_QUERIER = 'querier'
 KEY_OUTPUTS = 'outputs'
+KEY_PIPELINE = 'pipeline'
+KEY_INCREMENTAL = 'incremental'
+KEY_METRICS = 'metrics'
+KEY_CHECKPOINT = 'checkpoint'
+KEY_SHARDS = 'shards'
+KEY_PIPELINE_THREADED = 'threaded'
+KEY_PIPELINE_QUEUESIZE = 'queuesize'
+KEY_PIPELINE_BATCHSIZE = 'batchsize'
+KEY_PIPELINE_PROCESSES = 'processes'
 KEY_ITEMS = 'items'
 KEY_INFOS = 'infos'
+KEY_PLAININFOS = 'plaininfos'
 KEY_NAME = 'name'
 KEY_FEATURES = 'features'
 KEY_EVALUATOR = 'evaluator'
@@ -36,6 +55,12 @@ KEY_PATHFINDER_FORMAT = 'format'
 KEY_PATHFINDER_VALUE = 'value'
 USAGE_TYPES_MULTIPART = { 'schedule': ['%s start', '%s end'] }
 MAIN_FIELDS = ['itemindex', 'source', 'index', 'name', 'description', 'extrainfo', 'link']
+MAIN_TYPES = ['int', 'string', 'int', 'string', 'string', 'string', 'string']
+DEFAULT_PIPELINE_QUEUESIZE = 1000
+DEFAULT_PIPELINE_BATCHSIZE = 100
+SCHEDULE_CACHE_SIZE = 4096
+STATE_FIELDS = ['name', 'description', 'extrainfo']
+KEY_ITEM_STATE = '_state'
 TARGET_CURRENT = 'current'
 TARGET_EXTERNAL = 'external'
 TARGET_INDEX = 'index'
@@ -50,6 +75,10 @@ PATHFINDER_TYPE_FULLTEXT = 'fulltext'
 PATHFINDER_TYPE_SHOWCASE = 'showcase'
 PATHFINDER_FORMAT_NOW = 'now'
 PATHFINDER_FORMAT_LIST = 'list'
+PATHFINDER_INDEXERS_SORTED = {
+  'startswith': lambda line: line,
+  'endswith': lambda line: line[::-1]
+}
 LOGGING_FILE = 'downdrag_%s.log'
 LOGGING_STEP_QUERY = 'querying with %s'
 LOGGING_STEP_OUTPUT = 'outputting with %s'
@@ -61,196 +90,598 @@ LOGGING_STEP_ITEM_HANDLING = 'item %i handling'
 LOGGING_STEP_ITEM_ERROR = 'index %i error: %s'
 LOGGING_STEP_ITEM_DETAILS = 'item %i details'
 
-def execute(config, output_definitions=None):
+def execute(config, output_definitions=None, resume=False):
   now = datetime.now()
   profiles = config[KEY_PROFILES]
   querierconfig = config[KEY_QUERIER] if KEY_QUERIER in config else {}
   details = config[KEY_DETAILS] if KEY_DETAILS in config else {}
+  plans = [ProfilePlan(source, scrape_profile, now) for source, scrape_profile in profiles.items()]
+  detailplans = [DetailPlan(detailname, detail, now) for detailname, detail in details.items()]
+  metrics = None
+  if KEY_METRICS in config:
+    from metrics import RunMetrics
+    metrics = RunMetrics(config[KEY_METRICS])
+    for plan in plans: plan.instrument(metrics)
+    for detailplan in detailplans: detailplan.instrument(metrics)
+
+  headers = MAIN_FIELDS.copy()
+  types = MAIN_TYPES.copy()
+  for detailplan in detailplans:
+    headers.extend(detailplan.headers)
+    types.extend(detailplan.types)
+
+  pipelineconfig = config[KEY_PIPELINE] if KEY_PIPELINE in config else {}
+  queuesize = 0
+  if KEY_PIPELINE_THREADED in pipelineconfig and pipelineconfig[KEY_PIPELINE_THREADED]:
+    queuesize = int(pipelineconfig[KEY_PIPELINE_QUEUESIZE]) if KEY_PIPELINE_QUEUESIZE in pipelineconfig else DEFAULT_PIPELINE_QUEUESIZE
+  batchsize = int(pipelineconfig[KEY_PIPELINE_BATCHSIZE]) if KEY_PIPELINE_BATCHSIZE in pipelineconfig else DEFAULT_PIPELINE_BATCHSIZE
+  processes = int(pipelineconfig[KEY_PIPELINE_PROCESSES]) if KEY_PIPELINE_PROCESSES in pipelineconfig else 0
+  results_writer_factory = ResultsWriterFactory(output_definitions, queuesize, metrics)
+  outputsconfig = config[KEY_OUTPUTS]
+  sharded = KEY_SHARDS in config
+  state = ScrapeState(config[KEY_INCREMENTAL]) if KEY_INCREMENTAL in config and not sharded else None
+  journal = None
+  if KEY_CHECKPOINT in config and not sharded:
+    from journals import ScrapeJournal
+    journal = ScrapeJournal(config[KEY_CHECKPOINT], resume)
+  logging.info(LOGGING_STEP_OUTPUT % str(outputsconfig))
+  with metrics if metrics else nullcontext():
+    with journal if journal else nullcontext(), state if state else nullcontext(), results_writer_factory.create(outputsconfig, headers, types) as output:
+      if sharded:
+        scraped = coordinateshards(config, plans, now, resume, metrics)
+      else:
+        extraction = ExtractionPool(processes, profiles, now, querierconfig) if processes else None
+        scraped = scrapeitems(querierconfig, plans, state, metrics, extraction, journal)
+      items = convertitems(scraped, detailplans, batchsize)
+      for itemindex, item in enumerate(items):
+        writeitem(output, itemindex, item, detailplans)
+        recordstate(state, item)
+        if metrics: metrics.items += 1
+    if metrics and state:
+      metrics.statistics(KEY_INCREMENTAL, state.statistics)
+
+def scrapeitems(querierconfig, plans, state=None, metrics=None, extraction=None, journal=None):
+  concurrency = int(querierconfig[KEY_QUERIER_CONCURRENCY]) if KEY_QUERIER_CONCURRENCY in querierconfig else 1
   logging.info(LOGGING_STEP_QUERY % str(querierconfig))
-  items = []
-  with DataQuerier.Create(querierconfig) as querier:
-    for source, scrape_profile in profiles.items():
-      logging.info(LOGGING_STEP_TARGET % source)
+  if journal: from journals import restoreentry
+  with ExitStack() as stack:
+    querier = stack.enter_context(DataQuerier.Create(querierconfig))
+    executor = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+    if extraction: stack.enter_context(extraction)
+    plainquerier = None
+    mode = querierconfig[KEY_QUERIER_MODE] if KEY_QUERIER_MODE in querierconfig else QUERIER_PLAIN
+    if metrics: querier.instrument(metrics)
+    for plan in plans:
+      logging.info(LOGGING_STEP_TARGET % plan.source)
+      if mode == QUERIER_DYNAMIC and plan.plaininfos and not plainquerier:
+        plainconfig = dict(querierconfig)
+        plainconfig[KEY_QUERIER_MODE] = QUERIER_PLAIN
+        plainquerier = stack.enter_context(DataQuerier.Create(plainconfig))
+        if metrics: plainquerier.instrument(metrics)
+      if journal and journal.finished(plan.source):
+        for entry in journal.replay(plan.source):
+          scraped, fingerprint, status, yielded = restoreentry(entry)
+          if deferstate(state, plan.source, scraped, fingerprint, status, yielded): yield scraped
+        continue
       try:
-        for page in querier.pages(scrape_profile):
+        for page in plan.pages(querier):
           logging.info(LOGGING_STEP_PAGER)
-          data = page.xpath(scrape_profile[KEY_ITEMS])
-          index = 0
-          for item in data:
+          data = page.xpath(plan.items)
+          infosquerier = plainquerier if plan.plaininfos else None
+          completed = [journal.completed(plan.source, page.url, index) for index in range(len(data))] if journal else [None] * len(data)
+          fetches = [executor.submit(fetchitem, plan, page, item, state, infosquerier, extraction) if item is not None and completed[index] is None else None for index, item in enumerate(data)]
+          for index, item in enumerate(data):
             if item is None:
               logging.info(LOGGING_STEP_ITEM_SKIPPED % index)
-              index += 1
               continue
-            try:
-              logging.info(LOGGING_STEP_ITEM_HANDLING % index)
-              linkinfos = scrape_profile[KEY_INFOS] if KEY_INFOS in scrape_profile else 'descendant::a'
-              link = str(item.xpath(linkinfos)[0].attrib['href'])
-              link = page.rebase_link(link)
-              infos = page.get(link)
-              name = cleanvalue(infos.xpath(scrape_profile[KEY_NAME])[0])
-
-              features = infos.xpath(scrape_profile[KEY_FEATURES])
-              feature_items = []
-              for feat in features:
-                if feat is None: continue
-                match = search(scrape_profile[KEY_EVALUATOR], feat, IGNORECASE | DOTALL)
-                if not match: continue
-                value = match.group(1).replace('-', ',').strip()
-                if value.strip() != '':
-                  feature_items.append(value)
-              description = ','.join(feature_items)
-
-              extrainfo = ''
-              target_details = infos
-              if KEY_PATHFINDER in scrape_profile:
-                pathfinder = scrape_profile[KEY_PATHFINDER]
-                evaluatortarget = pathfinder[KEY_PATHFINDER_TARGET]
-                isexternaltarget = evaluatortarget == TARGET_EXTERNAL
-                extractvalue = pathfinder[KEY_PATHFINDER_VALUE]
-                if isexternaltarget:
-                  target_details = page.get(pathfinder[KEY_EVALUATOR_LINK])
-                if isexternaltarget or evaluatortarget == TARGET_CURRENT:
-                  extractmethod = pathfinder[KEY_PATHFINDER_TYPE]
-                  if extractmethod == PATHFINDER_TYPE_FULLTEXT:
-                    indexername = pathfinder[KEY_PATHFINDER_INDEXER]
-                    if not hasattr('', indexername):
-                      raise KeyError(indexername)
-                    extract = target_details.xpath(extractvalue)
-                    target_pattern = pathfinder[KEY_PATHFINDER_PATTERN]
-                    target_format = pathfinder[KEY_PATHFINDER_FORMAT]
-                    if target_format == PATHFINDER_FORMAT_NOW:
-                      target = now.strftime(target_pattern)
-                      target_items = target.upper().split()
-                      target_found = False
-                      for line in extract:
-                        line = cleanvalue(line)
-                        if target_found:
-                          if (isexternaltarget and getattr(line, indexername)(name.upper())) or (not isexternaltarget and line != ''):
-                            extrainfo = line
-                            break
-                        else:
-                          if line.upper().find(' '.join(target_items)) != -1:
-                            target_found = True
-                          elif line.upper().find(''.join(target_items)) != -1:
-                            target_found = True
-                    elif target_format == PATHFINDER_FORMAT_LIST:
-                      target_found = False
-                      extrainfo_line = ''
-                      for line in extract:
-                        line = cleanvalue(line)
-                        if target_found:
-                          if (isexternaltarget and getattr(line, indexername)(name.upper())) or (not isexternaltarget and line != ''):
-                            extrainfo += '%s: %s\n' % (extrainfo_line, line)
-                            target_found = False
-                        if test(target_pattern, line, IGNORECASE | DOTALL):
-                          extrainfo_line = line
-                          target_found = True
-                    else:
-                      raise KeyError(target_format)
-                  elif extractmethod == PATHFINDER_TYPE_SHOWCASE:
-                    extrainfo = cleantextnodes(target_details.xpath(extractvalue % name))
-                  else:
-                    raise KeyError(extractmethod)
-                elif evaluatortarget == TARGET_INDEX:
-                  extrainfo = cleantextnodes(item.xpath(extractvalue))
-                else:
-                  raise KeyError(evaluatortarget)
-              items.append({k: {'value': v} for k, v in vars().items() if k in MAIN_FIELDS})
-            except Exception as exc:
-              logging.exception(LOGGING_STEP_ITEM_ERROR % (index, str(exc)))
-            index += 1
+            if completed[index] is not None:
+              scraped, fingerprint, status, yielded = restoreentry(completed[index])
+            else:
+              try:
+                logging.info(LOGGING_STEP_ITEM_HANDLING % index)
+                fetched, extracted = fetches[index].result()
+                if extracted is not None: extracted = extracted.result()
+                scraped = plan.scrape(page, item, index, fetched, extracted)
+              except Exception as exc:
+                logging.exception(LOGGING_STEP_ITEM_ERROR % (index, str(exc)))
+                continue
+              fetches[index] = None
+              link, infos, target_details, fingerprint, status, record = fetched
+              yielded = not state or status != STATE_UNCHANGED or not state.changedonly
+              if journal: journal.append(plan.source, page.url, index, scraped, fingerprint, status, yielded)
+            if deferstate(state, plan.source, scraped, fingerprint, status, yielded): yield scraped
+        if journal: journal.finish(plan.source)
       except Exception as exc:
-        logging.exception(LOGGING_STEP_TARGET_ERROR % (source, str(exc)))
+        logging.exception(LOGGING_STEP_TARGET_ERROR % (plan.source, str(exc)))
+    if metrics:
+      metrics.statistics('cache', querier.statistics())
 
-  for index, item in enumerate(items):
-    logging.info(LOGGING_STEP_ITEM_DETAILS % index)
-    for detailname, detail in details.items():
-      try:
-        detailsource = item['description']['value']
-        if KEY_DETAILS_SOURCE in detail:
-          detailsource = item[detail[KEY_DETAILS_SOURCE]]['value']
-        truedefault = ''
-        writer = lambda output, value: output.write_string(value)
-        valueconverter = lambda value: value
-        detailstype = detail[KEY_DETAILS_TYPE] if KEY_DETAILS_TYPE in detail else TYPE_STRING
-        if detailstype == TYPE_INT:
-          truedefault = 0
-          writer = lambda output, value: output.write_int(value)
-          valueconverter = int
-        elif detailstype == TYPE_FLOAT:
-          truedefault = 0.
-          writer = lambda output, value: output.write_float(value)
-          valueconverter = float
-        elif detailstype != TYPE_STRING:
-          raise KeyError(detailstype)
-        value = None
-        detailsconversion = detail[KEY_DETAILS_CONVERSION]
-        conversionprocess = detailsconversion[KEY_DETAILS_CONVERSION_PROCESS]
-        if conversionprocess == CONVERSION_LAYER:
-          try: value = calculatelayer(detailsconversion[KEY_DETAILS_CONVERSION_FORMULA], {k: v['value'] for k, v in item.items()})
-          except: value = truedefault
-        elif conversionprocess == CONVERSION_SCHEDULE:
-          schedules = detailsconversion[KEY_DETAILS_CONVERSION_PATTERN]
-          if KEY_DETAILS_CONVERSION_CASE in detailsconversion:
-            schedules = schedules % now.strftime(detailsconversion[KEY_DETAILS_CONVERSION_CASE])
-          daysplit = -1
-          if KEY_DETAILS_CONVERSION_THRESHOLD in detailsconversion:
-            daysplit = int(detailsconversion[KEY_DETAILS_CONVERSION_THRESHOLD])
-          try: value = parseschedule(search(schedules, detailsource, IGNORECASE | DOTALL), daysplit)
-          except: value = (truedefault, truedefault)
-          oldwriter = writer
-          writer = lambda output, values: list(map(lambda value: oldwriter(output, value), values))
-        else:
-          matchconverter = lambda matches: ','.join(matches) if matches else truedefault
-          gotmatch = False
-          if conversionprocess == CONVERSION_VALUE:
-            matchconverter = lambda matches: valueconverter(matches[0]) if matches else truedefault
-          elif conversionprocess == CONVERSION_CALCULATE:
-            matchconverter = lambda matches: eval(detailsconversion[KEY_DETAILS_CONVERSION_FORMULA] % tuple(val or truedefault for val in matches)) if matches else truedefault
-          else:
-            raise KeyError(conversionprocess)
-          gotmatch = search(detailsconversion[KEY_DETAILS_CONVERSION_PATTERN], detailsource, IGNORECASE | DOTALL)
-          value = valueconverter(detail[KEY_DETAILS_DEFAULT]) if KEY_DETAILS_DEFAULT in detail else truedefault
-          if gotmatch:
-            try: value = matchconverter(gotmatch.groups())
-            except: value = truedefault
-        item[detailname] = {
-          'value': value,
-          'writer': writer
-        }
-      except:
-        item[detailname] = {
-          'value': None,
-          'writer': lambda output, value: output.write_empty()
-        }
+def deferstate(state, source, scraped, fingerprint, status, yielded):
+  if not state or not status: return yielded
+  pending = (source, scraped['link']['value'], fingerprint, {field: scraped[field]['value'] for field in STATE_FIELDS}, status)
+  if yielded: scraped[KEY_ITEM_STATE] = pending
+  else: state.record(*pending)
+  return yielded
 
-  headers = MAIN_FIELDS.copy()
-  for detailname, detail in details.items():
-    conversionprocess = detail[KEY_DETAILS_CONVERSION][KEY_DETAILS_CONVERSION_PROCESS]
-    if conversionprocess in USAGE_TYPES_MULTIPART:
-      for headerformat in USAGE_TYPES_MULTIPART[conversionprocess]:
-        headers.append(headerformat % detailname)
+def recordstate(state, item):
+  pending = item.pop(KEY_ITEM_STATE, None)
+  if state and pending: state.record(*pending)
+
+def fetchitem(plan, page, item, state, infosquerier, extraction):
+  fetched = plan.fetch(page, item, state, infosquerier, extraction is not None)
+  if extraction is None or fetched[5] is not None: return fetched, None
+  return fetched, extraction.submit(plan.source, fetched[1])
+
+class ExtractionPool(object):
+  def __init__(self, processes, profiles, now, querierconfig):
+    self.processes = processes
+    self.initargs = (profiles, now, querierconfig[KEY_QUERIER_LEAN] if KEY_QUERIER_LEAN in querierconfig else False)
+  def __enter__(self):
+    from concurrent.futures import ProcessPoolExecutor
+    self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=initextraction, initargs=self.initargs)
+    for started in [self.executor.submit(len, ()) for process in range(self.processes)]:
+      started.result()
+    return self
+  def __exit__(self, type, value, tb):
+    self.executor.shutdown()
+  def submit(self, source, content):
+    return self.executor.submit(extractinfos, source, content)
+
+EXTRACTION_PLANS = {}
+
+def initextraction(profiles, now, lean):
+  EXTRACTION_PLANS.clear()
+  for source, scrape_profile in profiles.items():
+    EXTRACTION_PLANS[source] = (ProfilePlan(source, scrape_profile, now), lean)
+
+def extractinfos(source, content):
+  plan, lean = EXTRACTION_PLANS[source]
+  return plan.extract(parsecontent(content, lean, plan.container))
+
+def coordinateshards(config, plans, now, resume=False, metrics=None):
+  from multiprocessing import Process
+  from shards import WorkQueue
+  from journals import restorerecord
+  with WorkQueue(config[KEY_SHARDS]) as queue:
+    if not (resume and queue.resume()):
+      queue.reset([(rank, plan.source, plan.profile[KEY_URL] if plan.source in queue.split and KEY_PAGERS in plan.profile and isinstance(plan.profile[KEY_PAGERS], str) else None) for rank, plan in enumerate(plans)])
+    workers = [Process(target=workshards, args=(config, now)) for worker in range(queue.workers - 1)]
+    for worker in workers: worker.start()
+    try:
+      workshards(config, now, metrics)
+    finally:
+      for worker in workers: worker.join()
+    for record in queue.results():
+      yield restorerecord(record)
+
+def workshards(config, now, metrics=None):
+  profiles = config[KEY_PROFILES]
+  querierconfig = config[KEY_QUERIER] if KEY_QUERIER in config else {}
+  plans = {source: ProfilePlan(source, scrape_profile, now) for source, scrape_profile in profiles.items()}
+  if metrics:
+    for plan in plans.values(): plan.instrument(metrics)
+  pipelineconfig = config[KEY_PIPELINE] if KEY_PIPELINE in config else {}
+  processes = int(pipelineconfig[KEY_PIPELINE_PROCESSES]) if KEY_PIPELINE_PROCESSES in pipelineconfig else 0
+  state = ScrapeState(config[KEY_INCREMENTAL], shared=True) if KEY_INCREMENTAL in config else None
+  from shards import WorkQueue
+  with WorkQueue(config[KEY_SHARDS]) as queue, state if state else nullcontext():
+    extraction = ExtractionPool(processes, profiles, now, querierconfig) if processes else None
+    shards = ShardPlans(queue, plans, state)
+    for scraped in scrapeitems(querierconfig, shards, state, metrics, extraction):
+      shards.collect(scraped)
+  if metrics and state:
+    metrics.statistics(KEY_INCREMENTAL, state.statistics)
+
+class ShardPlans(object):
+  def __init__(self, queue, plans, state=None):
+    self.queue = queue
+    self.plans = plans
+    self.state = state
+    self.current = None
+  def __iter__(self):
+    from shards import SHARDS_POLL
+    while True:
+      unit = self.queue.claim()
+      if unit is None:
+        if not self.queue.unfinished(): return
+        sleep(SHARDS_POLL)
+        continue
+      self.current = ShardPlan(self.plans[unit.source], unit, self.queue)
+      yield self.current
+      if self.queue.complete(unit):
+        for item in self.current.written: recordstate(self.state, item)
+  def collect(self, scraped):
+    from journals import recordvalues
+    self.current.unit.records.append(recordvalues(scraped))
+    self.current.written.append(scraped)
+    self.queue.renew(self.current.unit)
+
+class ShardPlan(object):
+  def __init__(self, plan, unit, queue):
+    self.plan = plan
+    self.unit = unit
+    self.queue = queue
+    self.written = []
+  def __getattr__(self, name):
+    return getattr(self.plan, name)
+  def pages(self, querier):
+    if self.unit.url is None: return self.plan.pages(querier)
+    return self.splitpages(querier)
+  def splitpages(self, querier):
+    page = querier.page(self.plan.profile, self.unit.url)
+    url = querier.nextpage(self.plan.profile, page)
+    if url: self.queue.add(self.unit, url)
+    yield page
+
+def convertitems(items, detailplans, batchsize=1):
+  items = iter(items)
+  index = 0
+  while True:
+    batch = list(islice(items, batchsize))
+    if not batch: return
+    for itemindex in range(index, index + len(batch)):
+      logging.info(LOGGING_STEP_ITEM_DETAILS % itemindex)
+    index += len(batch)
+    for detailplan in detailplans:
+      for item, converted in zip(batch, detailplan.convertcolumn(batch)):
+        item[detailplan.name] = converted
+    for item in batch:
+      yield item
+
+def writeitem(output, itemindex, item, detailplans):
+  output.start_item(itemindex)
+  output.write_string(item['source']['value'])
+  output.write_int(item['index']['value'])
+  output.write_string(item['name']['value'])
+  output.write_string(item['description']['value'])
+  output.write_string(item['extrainfo']['value'])
+  output.write_string(item['link']['value'])
+  for detailplan in detailplans:
+    detailconfig = item[detailplan.name]
+    detailconfig['writer'](output, detailconfig['value'])
+  output.end_item()
+
+class ProfilePlan(object):
+  def __init__(self, source, scrape_profile, now):
+    self.source = source
+    self.profile = scrape_profile
+    self.items = XPath(scrape_profile[KEY_ITEMS])
+    self.infos = XPath(scrape_profile[KEY_INFOS] if KEY_INFOS in scrape_profile else 'descendant::a')
+    self.name = XPath(scrape_profile[KEY_NAME])
+    self.features = XPath(scrape_profile[KEY_FEATURES])
+    self.evaluator = regex(scrape_profile[KEY_EVALUATOR], IGNORECASE | DOTALL)
+    self.search = self.evaluator.search
+    self.pathfinder = PathfinderPlan(scrape_profile[KEY_PATHFINDER], now) if KEY_PATHFINDER in scrape_profile else None
+    self.plaininfos = scrape_profile[KEY_PLAININFOS] if KEY_PLAININFOS in scrape_profile else False
+    self.container = XPath(scrape_profile[KEY_CONTAINER]) if KEY_CONTAINER in scrape_profile else None
+    self.datedtargets = None
+    if self.pathfinder and self.pathfinder.target == TARGET_CURRENT and self.pathfinder.type == PATHFINDER_TYPE_FULLTEXT and self.pathfinder.format == PATHFINDER_FORMAT_NOW:
+      self.datedtargets = '\n'.join(self.pathfinder.targets)
+  def instrument(self, metrics):
+    from metrics import STAGE_EXTRACT
+    self.items = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_ITEMS), self.items)
+    self.infos = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_INFOS), self.infos)
+    self.name = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_NAME), self.name)
+    self.features = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_FEATURES), self.features)
+    self.search = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_EVALUATOR), self.search)
+    if self.pathfinder and hasattr(self.pathfinder, 'extract'):
+      self.pathfinder.extract = metrics.timed(STAGE_EXTRACT, '%s.%s' % (self.source, KEY_PATHFINDER), self.pathfinder.extract)
+  def pages(self, querier):
+    return querier.pages(self.profile)
+  def fetch(self, page, item, state=None, infosquerier=None, raw=False):
+    link = str(self.infos(item)[0].attrib['href'])
+    link = page.rebase_link(link)
+    fingerprint, status, record = None, None, None
+    if state:
+      digest = sha1(tostring(item, with_tail=False))
+      if self.datedtargets: digest.update(self.datedtargets.encode('utf8'))
+      fingerprint = digest.hexdigest()
+      status, record = state.lookup(self.source, link, fingerprint)
+      if record is not None:
+        return link, None, self.showcase(page, infosquerier), fingerprint, status, record
+    if raw: infos = infosquerier.get_content(link) if infosquerier else page.get_content(link)
+    else: infos = infosquerier.get(link, page.container) if infosquerier else page.get(link)
+    target_details = self.showcase(page, infosquerier)
+    if target_details is None: target_details = infos
+    return link, infos, target_details, fingerprint, status, record
+  def showcase(self, page, infosquerier=None):
+    if self.pathfinder and self.pathfinder.target == TARGET_EXTERNAL and self.pathfinder.type == PATHFINDER_TYPE_SHOWCASE:
+      return infosquerier.get(page.rebase_link(self.pathfinder.link)) if infosquerier else page.get(self.pathfinder.link, whole=True)
+    return None
+  def scrape(self, page, item, index, fetched, extracted=None):
+    link, infos, target_details, fingerprint, status, record = fetched
+    if record is not None:
+      return self.restore(page, item, index, link, record, target_details)
+    name, description, extrainfo = extracted if extracted else self.extract(infos)
+    if extrainfo is None:
+      extrainfo = self.pathfinder.extrainfo(page, item, name, target_details) if self.pathfinder else ''
+    return {
+      'source': {'value': self.source},
+      'index': {'value': index},
+      'link': {'value': link},
+      'name': {'value': name},
+      'description': {'value': description},
+      'extrainfo': {'value': extrainfo}
+    }
+  def extract(self, infos):
+    name = cleanvalue(self.name(infos)[0])
+    feature_items = []
+    for feat in self.features(infos):
+      if feat is None: continue
+      match = self.search(feat)
+      if not match: continue
+      value = match.group(1).replace('-', ',').strip()
+      if value.strip() != '':
+        feature_items.append(value)
+    description = ','.join(feature_items)
+    extrainfo = None
+    if self.pathfinder and self.pathfinder.target == TARGET_CURRENT:
+      extrainfo = self.pathfinder.extrainfo(None, None, name, infos)
+    return name, description, extrainfo
+  def restore(self, page, item, index, link, record, target_details=None):
+    extrainfo = record['extrainfo']
+    if self.pathfinder and self.pathfinder.target == TARGET_EXTERNAL:
+      extrainfo = self.pathfinder.extrainfo(page, item, record['name'], target_details)
+    return {
+      'source': {'value': self.source},
+      'index': {'value': index},
+      'link': {'value': link},
+      'name': {'value': record['name']},
+      'description': {'value': record['description']},
+      'extrainfo': {'value': extrainfo}
+    }
+
+class PathfinderPlan(object):
+  def __init__(self, pathfinder, now):
+    self.target = pathfinder[KEY_PATHFINDER_TARGET]
+    self.type = None
+    self.index = None
+    extractvalue = pathfinder[KEY_PATHFINDER_VALUE]
+    if self.target == TARGET_INDEX:
+      self.extract = XPath(extractvalue)
+      return
+    elif self.target == TARGET_EXTERNAL:
+      self.link = pathfinder[KEY_EVALUATOR_LINK]
+    elif self.target != TARGET_CURRENT:
+      raise KeyError(self.target)
+    self.type = pathfinder[KEY_PATHFINDER_TYPE]
+    if self.type == PATHFINDER_TYPE_FULLTEXT:
+      self.extract = XPath(extractvalue)
+      self.format = pathfinder[KEY_PATHFINDER_FORMAT]
+      target_pattern = pathfinder[KEY_PATHFINDER_PATTERN]
+      if self.format == PATHFINDER_FORMAT_NOW:
+        target_items = now.strftime(target_pattern).upper().split()
+        self.targets = (' '.join(target_items), ''.join(target_items))
+      elif self.format == PATHFINDER_FORMAT_LIST:
+        self.headers = regex(target_pattern, IGNORECASE | DOTALL)
+      else:
+        raise KeyError(self.format)
+      self.indexer = None
+      if self.target == TARGET_EXTERNAL:
+        self.indexer = pathfinder[KEY_PATHFINDER_INDEXER]
+        if not hasattr('', self.indexer):
+          raise KeyError(self.indexer)
+    elif self.type == PATHFINDER_TYPE_SHOWCASE:
+      self.showcase = extractvalue
+      XPath(self.showcase % '')
     else:
-      headers.append(detailname)
+      raise KeyError(self.type)
+  def istarget(self, line):
+    line = line.upper()
+    return line.find(self.targets[0]) != -1 or line.find(self.targets[1]) != -1
+  def extrainfo(self, page, item, name, target_details):
+    if self.target == TARGET_INDEX:
+      return cleantextnodes(self.extract(item))
+    if self.type == PATHFINDER_TYPE_SHOWCASE:
+      return cleantextnodes(target_details.xpath(self.showcase % name))
+    if self.target == TARGET_EXTERNAL:
+      if self.index is None:
+        self.index = PathfinderIndex(self.extract(page.get(self.link, whole=True)), self)
+      return self.index.lookup(name)
+    extrainfo = ''
+    target_found = False
+    if self.format == PATHFINDER_FORMAT_NOW:
+      for line in self.extract(target_details):
+        line = cleanvalue(line)
+        if target_found:
+          if line != '':
+            return line
+        elif self.istarget(line):
+          target_found = True
+    else:
+      extrainfo_line = ''
+      for line in self.extract(target_details):
+        line = cleanvalue(line)
+        if target_found and line != '':
+          extrainfo += '%s: %s\n' % (extrainfo_line, line)
+          target_found = False
+        if self.headers.match(line):
+          extrainfo_line = line
+          target_found = True
+    return extrainfo
 
-  results_writer_factory = ResultsWriterFactory(output_definitions)
-  outputsconfig = config[KEY_OUTPUTS]
-  logging.info(LOGGING_STEP_OUTPUT % str(outputsconfig))
-  itemindex = 0
-  with results_writer_factory.create(outputsconfig, headers) as output:
-    for item in items:
-      output.start_item(itemindex)
-      output.write_string(item['source']['value'])
-      output.write_int(item['index']['value'])
-      output.write_string(item['name']['value'])
-      output.write_string(item['description']['value'])
-      output.write_string(item['extrainfo']['value'])
-      output.write_string(item['link']['value'])
-      for detailname in details.keys():
-        detailconfig = item[detailname]
-        detailconfig['writer'](output, detailconfig['value'])
-      output.end_item()
-      itemindex += 1
+class PathfinderIndex(object):
+  def __init__(self, extract, pathfinder):
+    self.lines = [cleanvalue(line) for line in extract]
+    self.indexername = pathfinder.indexer
+    self.format = pathfinder.format
+    self.results = {}
+    if self.format == PATHFINDER_FORMAT_NOW:
+      self.start = len(self.lines)
+      for position, line in enumerate(self.lines):
+        if pathfinder.istarget(line):
+          self.start = position
+          break
+    else:
+      self.headers = [position for position, line in enumerate(self.lines) if pathfinder.headers.match(line)]
+      self.start = self.headers[0] if self.headers else len(self.lines)
+    self.sorted = None
+    if self.indexername in PATHFINDER_INDEXERS_SORTED:
+      sortkey = PATHFINDER_INDEXERS_SORTED[self.indexername]
+      self.sorted = sorted((sortkey(line), position) for position, line in enumerate(self.lines) if position > self.start)
+  def positions(self, name):
+    if self.sorted is None:
+      indexer = self.indexername
+      return [position for position in range(self.start + 1, len(self.lines)) if getattr(self.lines[position], indexer)(name)]
+    key = PATHFINDER_INDEXERS_SORTED[self.indexername](name)
+    positions = []
+    for sortedindex in range(bisect_left(self.sorted, (key,)), len(self.sorted)):
+      line, position = self.sorted[sortedindex]
+      if not line.startswith(key): break
+      positions.append(position)
+    return sorted(positions)
+  def lookup(self, name):
+    name = name.upper()
+    if name not in self.results:
+      positions = self.positions(name)
+      if self.format == PATHFINDER_FORMAT_NOW:
+        extrainfo = self.lines[positions[0]] if positions else ''
+      else:
+        found = {}
+        for position in positions:
+          header = self.headers[bisect_left(self.headers, position) - 1]
+          if header not in found:
+            found[header] = position
+        extrainfo = ''.join('%s: %s\n' % (self.lines[header], self.lines[position]) for header, position in found.items())
+      self.results[name] = extrainfo
+    return self.results[name]
+
+class DetailPlan(object):
+  def __init__(self, detailname, detail, now):
+    self.name = detailname
+    self.source = detail[KEY_DETAILS_SOURCE] if KEY_DETAILS_SOURCE in detail else 'description'
+    detailstype = detail[KEY_DETAILS_TYPE] if KEY_DETAILS_TYPE in detail else TYPE_STRING
+    if detailstype not in DETAILS_TYPES:
+      raise KeyError(detailstype)
+    self.truedefault, self.writer, self.valueconverter = DETAILS_TYPES[detailstype]
+    detailsconversion = detail[KEY_DETAILS_CONVERSION]
+    self.process = detailsconversion[KEY_DETAILS_CONVERSION_PROCESS]
+    if self.process in USAGE_TYPES_MULTIPART:
+      self.headers = [headerformat % detailname for headerformat in USAGE_TYPES_MULTIPART[self.process]]
+    else:
+      self.headers = [detailname]
+    self.types = [detailstype for header in self.headers]
+    if self.process == CONVERSION_LAYER:
+      self.formula = detailsconversion[KEY_DETAILS_CONVERSION_FORMULA]
+      from expressions import compileexpression
+      self.expression = compileexpression(self.formula)
+    elif self.process == CONVERSION_SCHEDULE:
+      schedules = detailsconversion[KEY_DETAILS_CONVERSION_PATTERN]
+      if KEY_DETAILS_CONVERSION_CASE in detailsconversion:
+        schedules = schedules % now.strftime(detailsconversion[KEY_DETAILS_CONVERSION_CASE])
+      self.pattern = regex(schedules, IGNORECASE | DOTALL)
+      self.daysplit = -1
+      if KEY_DETAILS_CONVERSION_THRESHOLD in detailsconversion:
+        self.daysplit = int(detailsconversion[KEY_DETAILS_CONVERSION_THRESHOLD])
+      self.partwriter = self.writer
+      self.writer = self.writeparts
+    elif self.process == CONVERSION_VALUE or self.process == CONVERSION_CALCULATE:
+      self.pattern = regex(detailsconversion[KEY_DETAILS_CONVERSION_PATTERN], IGNORECASE | DOTALL)
+      self.default = self.valueconverter(detail[KEY_DETAILS_DEFAULT]) if KEY_DETAILS_DEFAULT in detail else self.truedefault
+      if self.process == CONVERSION_CALCULATE:
+        self.formula = detailsconversion[KEY_DETAILS_CONVERSION_FORMULA]
+        from expressions import compilecalculation
+        self.expression = compilecalculation(self.formula, self.pattern.groups)
+    else:
+      raise KeyError(self.process)
+  def instrument(self, metrics):
+    from metrics import STAGE_CONVERT
+    self.convertcolumn = metrics.timed(STAGE_CONVERT, self.name, self.convertcolumn)
+  def writeparts(self, output, values):
+    for value in values:
+      self.partwriter(output, value)
+  def convertmatches(self, matches):
+    if not matches: return self.truedefault
+    if self.process == CONVERSION_VALUE:
+      return self.valueconverter(matches[0])
+    return self.expression([val or self.truedefault for val in matches])
+  def convert(self, item):
+    return self.convertcolumn([item])[0]
+  def convertcolumn(self, items):
+    sources = [columnvalue(item, self.source) for item in items]
+    if self.process == CONVERSION_LAYER:
+      values = [self.layervalue(item) if source is not MISSING else MISSING for item, source in zip(items, sources)]
+    elif self.process == CONVERSION_SCHEDULE:
+      values = [self.schedulevalue(source) if source is not MISSING else MISSING for source in sources]
+    else:
+      values = self.matchvalues(sources)
+    return [{'value': value, 'writer': self.writer} if value is not MISSING else {'value': None, 'writer': writeempty} for value in values]
+  def layervalue(self, item):
+    try: return self.expression(ItemValues(item))
+    except: return self.truedefault
+  def schedulevalue(self, source):
+    try: return parseschedule(self.pattern.search(source), self.daysplit)
+    except: return (self.truedefault, self.truedefault)
+  def matchvalues(self, sources):
+    values = []
+    matched = []
+    for source in sources:
+      if source is MISSING:
+        values.append(MISSING)
+        continue
+      try: gotmatch = self.pattern.search(source)
+      except:
+        values.append(MISSING)
+        continue
+      if gotmatch:
+        matched.append(len(values))
+        values.append(gotmatch.groups())
+      else:
+        values.append(self.default)
+    if not self.pattern.groups:
+      converted = [self.truedefault for position in matched]
+    elif self.process == CONVERSION_VALUE:
+      converted = convertvalues(self.valueconverter, [values[position][0] for position in matched], self.truedefault)
+    else:
+      converted = [self.calculatevalue(values[position]) for position in matched]
+    for position, value in zip(matched, converted):
+      values[position] = value
+    return values
+  def calculatevalue(self, matches):
+    try: return self.convertmatches(matches)
+    except: return self.truedefault
+
+MISSING = object()
+
+def columnvalue(item, source):
+  try: return item[source]['value']
+  except: return MISSING
+
+def convertvalues(converter, values, default):
+  try: return list(map(converter, values))
+  except:
+    converted = []
+    for value in values:
+      try: converted.append(converter(value))
+      except: converted.append(default)
+    return converted
+
+class ItemValues(object):
+  def __init__(self, item):
+    self.item = item
+  def __getitem__(self, name):
+    return self.item[name]['value']
+
+def writestring(output, value):
+  output.write_string(value)
+
+def writeint(output, value):
+  output.write_int(value)
+
+def writefloat(output, value):
+  output.write_float(value)
+
+def writeempty(output, value):
+  output.write_empty()
+
+def keepvalue(value):
+  return value
+
+DETAILS_TYPES = {
+  TYPE_STRING: ('', writestring, keepvalue),
+  TYPE_INT: (0, writeint, int),
+  TYPE_FLOAT: (0., writefloat, float)
+}
 
 def parseTimevalue(timevalue, daysplit = -1, daythreshold = None):
   timevalue = timevalue.upper()
@@ -287,18 +718,20 @@ def parseTimevalue(timevalue, daysplit = -1, daythreshold = None):
   return ':'.join(time_parts)
 
 def calculatelayer(formula, detailvalues):
-  parsedformula = formula
-  for name, value in detailvalues.items():
-    parsedformula = parsedformula.replace(name, str(value))
-  return eval(parsedformula)
+  from expressions import compileexpression
+  return compileexpression(formula)(detailvalues)
 
 def parseschedule(match, daysplit = -1):
-  start = ''
-  end = ''
   if match:
-    start = parseTimevalue(match[1], daysplit)
-    if match[2]:
-      end = parseTimevalue(match[2], daysplit, start)
+    return parsescheduletimes(match[1], match[2], daysplit)
+  return ('', '')
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def parsescheduletimes(starttime, endtime, daysplit = -1):
+  start = parseTimevalue(starttime, daysplit)
+  end = ''
+  if endtime:
+    end = parseTimevalue(endtime, daysplit, start)
   return (start, end)
 
 def cleanvalue(value):
@@ -312,15 +745,23 @@ def cleantextnodes(nodes):
   return '\n'.join(cleanvalue(val) for val in nodes)
 
 if __name__ == "__main__":
-  from confuse import Configuration
-  from yamale import make_schema, make_data, validate
+  from configs import loadconfig
+  from argparse import ArgumentParser
   from sys import exit
+  parser = ArgumentParser(prog=APPLICATION_NAME)
+  parser.add_argument('--resume', action='store_true', help='skip the work recorded by the checkpoint journal or the shards queue of an interrupted run')
+  parser.add_argument('--worker', action='store_true', help='only work the units of the shards queue, for a coordinator run on another host')
+  arguments = parser.parse_args()
   logging.basicConfig(filename=LOGGING_FILE % cleanfiledatetime(datetime.now()), level=logging.INFO)
-  try: validate(make_schema(APPLICATION_CONFIG_SCHEMA), make_data(APPLICATION_CONFIG_FILENAME))
+  try: config = loadconfig(APPLICATION_NAME, APPLICATION_CONFIG_FILENAME, APPLICATION_CONFIG_SCHEMA)
   except:
     print("Configuration isn't valid.")
     exit(-1)
-  config = Configuration(APPLICATION_NAME)
-  config.set_file(APPLICATION_CONFIG_FILENAME)
-  execute(config.get())
+  if arguments.worker:
+    if KEY_SHARDS not in config:
+      print("Configuration has no shards.")
+      exit(-1)
+    workshards(config, datetime.now())
+  else:
+    execute(config, resume=arguments.resume)
   exit(0)
@@ -0,0 +1,105 @@
+from functools import lru_cache
+from re import compile as regex
+import ast
+import operator
+
+EXPRESSION_INVALID = 'invalid expression %s: %s'
+EXPRESSION_NOT_NUMERIC = 'value of %s is not numeric: %s'
+EXPRESSION_GROUPS = 'placeholders of %s don\'t match its %i groups: %s'
+EXPRESSION_EXPONENT = 'exponent %s is above %i'
+POWER_MAX_EXPONENT = 64
+CALCULATE_VARIABLE = '_%i'
+NUMERIC_LITERAL = regex(r'^[+-]?(\d+\.?\d*|\.\d+)$')
+LITERAL_CACHE_SIZE = 4096
+BINARY_OPERATORS = {
+  ast.Add: operator.add,
+  ast.Sub: operator.sub,
+  ast.Mult: operator.mul,
+  ast.Div: operator.truediv,
+  ast.FloorDiv: operator.floordiv,
+  ast.Mod: operator.mod,
+  ast.Pow: lambda base, exponent: power(base, exponent)
+}
+UNARY_OPERATORS = {
+  ast.UAdd: operator.pos,
+  ast.USub: operator.neg
+}
+FUNCTIONS = {
+  'abs': abs,
+  'min': min,
+  'max': max,
+  'round': round
+}
+
+@lru_cache(maxsize=None)
+def compileexpression(formula):
+  return parseexpression(formula)
+
+@lru_cache(maxsize=LITERAL_CACHE_SIZE)
+def evaluateliteral(formula):
+  return parseexpression(formula)({})
+
+def compilecalculation(formula, groups):
+  variables = [CALCULATE_VARIABLE % group for group in range(groups)]
+  try: formula % tuple(variables)
+  except TypeError as exc: raise ValueError(EXPRESSION_GROUPS % (formula, groups, str(exc)))
+  try: evaluate = compileexpression(formula % tuple('(%s)' % variable for variable in variables))
+  except ValueError:
+    parseexpression(formula % tuple('1' for variable in variables))
+    return lambda values: evaluateliteral(formula % tuple(literal(variable, value) for variable, value in zip(variables, values)))
+  return lambda values: evaluate(dict(zip(variables, values)))
+
+def parseexpression(formula):
+  try: tree = ast.parse(formula.strip(), mode='eval')
+  except SyntaxError as exc: raise ValueError(EXPRESSION_INVALID % (formula, str(exc)))
+  evaluate, constant = compilenode(tree.body, formula)
+  return evaluate
+
+def compilenode(node, formula):
+  if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+    value = node.value
+    return (lambda values: value), True
+  if isinstance(node, ast.Name):
+    name = node.id
+    return (lambda values: numeric(name, values[name])), False
+  if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+    function = BINARY_OPERATORS[type(node.op)]
+    left, leftconstant = compilenode(node.left, formula)
+    right, rightconstant = compilenode(node.right, formula)
+    evaluate = lambda values: function(left(values), right(values))
+    return foldconstant(evaluate, leftconstant and rightconstant)
+  if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+    function = UNARY_OPERATORS[type(node.op)]
+    operand, constant = compilenode(node.operand, formula)
+    return foldconstant(lambda values: function(operand(values)), constant)
+  if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+    function = FUNCTIONS[node.func.id]
+    arguments = [compilenode(argument, formula) for argument in node.args]
+    evaluators = [evaluate for evaluate, constant in arguments]
+    evaluate = lambda values: function(*[argument(values) for argument in evaluators])
+    return foldconstant(evaluate, all(constant for evaluate, constant in arguments))
+  raise ValueError(EXPRESSION_INVALID % (formula, ast.dump(node)))
+
+def foldconstant(evaluate, constant):
+  if not constant: return evaluate, False
+  try: value = evaluate(None)
+  except ArithmeticError: return evaluate, True
+  return (lambda values: value), True
+
+def power(base, exponent):
+  if abs(exponent) > POWER_MAX_EXPONENT: raise ValueError(EXPRESSION_EXPONENT % (repr(exponent), POWER_MAX_EXPONENT))
+  return operator.pow(base, exponent)
+
+def literal(name, value):
+  value = str(value).strip()
+  if not NUMERIC_LITERAL.match(value): raise ValueError(EXPRESSION_NOT_NUMERIC % (name, repr(value)))
+  return value
+
+def numeric(name, value):
+  if isinstance(value, (int, float)): return value
+  if isinstance(value, str):
+    try: return int(value)
+    except ValueError: pass
+    try: return float(value)
+    except ValueError: pass
+  raise ValueError(EXPRESSION_NOT_NUMERIC % (name, repr(value)))
@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+
+KEY_CHECKPOINT_FILENAME = 'filename'
+KEY_CHECKPOINT_FLUSHINTERVAL = 'flushinterval'
+KEY_JOURNAL_SOURCE = 'source'
+KEY_JOURNAL_PAGE = 'page'
+KEY_JOURNAL_INDEX = 'index'
+KEY_JOURNAL_RECORD = 'record'
+KEY_JOURNAL_FINGERPRINT = 'fingerprint'
+KEY_JOURNAL_STATUS = 'status'
+KEY_JOURNAL_YIELDED = 'yielded'
+KEY_JOURNAL_DONE = 'done'
+JOURNAL_FIELDS = ['source', 'index', 'link', 'name', 'description', 'extrainfo']
+DEFAULT_CHECKPOINT_FLUSHINTERVAL = 1
+LOGGING_JOURNAL_RESUME = 'resuming from %s: %i items of %i sources, %i sources done'
+
+class ScrapeJournal(object):
+  def __init__(self, checkpointconfig, resume=False):
+    self.filename = checkpointconfig[KEY_CHECKPOINT_FILENAME]
+    self.flushinterval = int(checkpointconfig[KEY_CHECKPOINT_FLUSHINTERVAL]) if KEY_CHECKPOINT_FLUSHINTERVAL in checkpointconfig else DEFAULT_CHECKPOINT_FLUSHINTERVAL
+    self.resume = resume
+  def __enter__(self):
+    self.entries = {}
+    self.replays = {}
+    self.done = set()
+    if self.resume: self.load()
+    self.unflushed = 0
+    self.journal = open(self.filename, 'a' if self.resume else 'w', encoding='utf8')
+    return self
+  def __exit__(self, type, value, tb):
+    self.journal.close()
+    if type is None: os.remove(self.filename)
+  def load(self):
+    try:
+      with open(self.filename, 'r', encoding='utf8') as journal:
+        for line in journal:
+          try: entry = json.loads(line)
+          except ValueError: continue
+          source = entry[KEY_JOURNAL_SOURCE]
+          if KEY_JOURNAL_DONE in entry:
+            self.done.add(source)
+            continue
+          self.entries[(source, entry[KEY_JOURNAL_PAGE], entry[KEY_JOURNAL_INDEX])] = entry
+          self.replays.setdefault(source, []).append(entry)
+    except OSError:
+      return
+    logging.info(LOGGING_JOURNAL_RESUME % (self.filename, len(self.entries), len(self.replays), len(self.done)))
+  def finished(self, source):
+    return source in self.done
+  def completed(self, source, page, index):
+    return self.entries.get((source, page, index))
+  def replay(self, source):
+    return self.replays.get(source, [])
+  def append(self, source, page, index, scraped, fingerprint, status, yielded):
+    self.write({
+      KEY_JOURNAL_SOURCE: source,
+      KEY_JOURNAL_PAGE: page,
+      KEY_JOURNAL_INDEX: index,
+      KEY_JOURNAL_RECORD: recordvalues(scraped),
+      KEY_JOURNAL_FINGERPRINT: fingerprint,
+      KEY_JOURNAL_STATUS: status,
+      KEY_JOURNAL_YIELDED: yielded
+    })
+  def finish(self, source):
+    self.write({KEY_JOURNAL_SOURCE: source, KEY_JOURNAL_DONE: True})
+  def write(self, entry):
+    self.journal.write(json.dumps(entry) + '\n')
+    self.unflushed += 1
+    if self.unflushed >= self.flushinterval:
+      self.journal.flush()
+      self.unflushed = 0
+
+def restoreentry(entry):
+  return restorerecord(entry[KEY_JOURNAL_RECORD]), entry[KEY_JOURNAL_FINGERPRINT], entry[KEY_JOURNAL_STATUS], entry[KEY_JOURNAL_YIELDED]
+
+def recordvalues(scraped):
+  return {field: scraped[field]['value'] for field in JOURNAL_FIELDS}
+
+def restorerecord(record):
+  return {field: {'value': value} for field, value in record.items()}
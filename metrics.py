@@ -0,0 +1,115 @@
+from threading import Lock
+from time import perf_counter, time
+from urllib.parse import urlparse
+import json
+import logging
+import os
+
+KEY_METRICS_FILENAME = 'filename'
+KEY_METRICS_TEXTFILE = 'textfile'
+STAGE_FETCH = 'fetch'
+STAGE_PARSE = 'parse'
+STAGE_EXTRACT = 'extract'
+STAGE_CONVERT = 'convert'
+STAGE_WRITE = 'write'
+METRICS_PREFIX = 'downdrag'
+LOGGING_METRICS = 'metrics: %s'
+
+class RunMetrics(object):
+  def __init__(self, metricsconfig):
+    self.filename = metricsconfig[KEY_METRICS_FILENAME] if KEY_METRICS_FILENAME in metricsconfig else None
+    self.textfile = metricsconfig[KEY_METRICS_TEXTFILE] if KEY_METRICS_TEXTFILE in metricsconfig else None
+    self.items = 0
+    self.__stages = {}
+    self.__statistics = {}
+    self.__lock = Lock()
+  def __enter__(self):
+    self.started = time()
+    self.__clock = perf_counter()
+    return self
+  def __exit__(self, type, value, tb):
+    self.elapsed = perf_counter() - self.__clock
+    summary = self.summary()
+    logging.info(LOGGING_METRICS % json.dumps(summary))
+    if self.filename:
+      replacefile(self.filename, json.dumps(summary, indent=2))
+    if self.textfile:
+      replacefile(self.textfile, self.prometheus(summary))
+  def record(self, stage, label, seconds, size=0):
+    with self.__lock:
+      labels = self.__stages.setdefault(stage, {})
+      if label not in labels:
+        labels[label] = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0}
+      entry = labels[label]
+      entry['count'] += 1
+      entry['seconds'] += seconds
+      entry['bytes'] += size
+      if seconds > entry['max']: entry['max'] = seconds
+  def timed(self, stage, label, function):
+    def measured(*args, **kwargs):
+      started = perf_counter()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        self.record(stage, label, perf_counter() - started)
+    return measured
+  def stopwatch(self, stage, label):
+    return Stopwatch(self, stage, label)
+  def fetched(self, link, status, headers, size, elapsed):
+    self.record(STAGE_FETCH, urlparse(link).hostname, elapsed, size)
+  def statistics(self, name, values):
+    with self.__lock:
+      self.__statistics[name] = dict(values)
+  def summary(self):
+    with self.__lock:
+      summary = {
+        'started': self.started,
+        'elapsed': self.elapsed,
+        'items': self.items,
+        'stages': {stage: {label: dict(entry) for label, entry in labels.items()} for stage, labels in self.__stages.items()}
+      }
+      summary.update({name: dict(values) for name, values in self.__statistics.items()})
+    cache = summary.get('cache')
+    if cache:
+      queried = cache['hits'] + cache['revalidated'] + cache['misses']
+      cache['ratio'] = (cache['hits'] + cache['revalidated']) / queried if queried else 0.0
+    return summary
+  def prometheus(self, summary):
+    lines = [
+      '# TYPE %s_run_seconds gauge' % METRICS_PREFIX,
+      '%s_run_seconds %s' % (METRICS_PREFIX, repr(summary['elapsed'])),
+      '# TYPE %s_items_total counter' % METRICS_PREFIX,
+      '%s_items_total %i' % (METRICS_PREFIX, summary['items'])
+    ]
+    for metric, field, kind in [('stage_calls_total', 'count', 'counter'), ('stage_seconds_total', 'seconds', 'counter'), ('stage_seconds_max', 'max', 'gauge'), ('stage_bytes_total', 'bytes', 'counter')]:
+      lines.append('# TYPE %s_%s %s' % (METRICS_PREFIX, metric, kind))
+      for stage, labels in summary['stages'].items():
+        for label, entry in labels.items():
+          lines.append('%s_%s{stage="%s",label="%s"} %s' % (METRICS_PREFIX, metric, stage, promlabel(label), repr(entry[field])))
+    lines.append('# TYPE %s_statistics gauge' % METRICS_PREFIX)
+    for name, values in summary.items():
+      if name in ('started', 'elapsed', 'items', 'stages'): continue
+      for key, value in values.items():
+        if isinstance(value, (int, float)):
+          lines.append('%s_statistics{name="%s",key="%s"} %s' % (METRICS_PREFIX, promlabel(name), promlabel(key), repr(value)))
+    return '\n'.join(lines) + '\n'
+
+class Stopwatch(object):
+  def __init__(self, metrics, stage, label):
+    self.metrics = metrics
+    self.stage = stage
+    self.label = label
+  def __enter__(self):
+    self.started = perf_counter()
+    return self
+  def __exit__(self, type, value, tb):
+    self.metrics.record(self.stage, self.label, perf_counter() - self.started)
+
+def promlabel(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def replacefile(filename, content):
+  temporary = '%s.%i.tmp' % (filename, os.getpid())
+  with open(temporary, 'w', encoding='utf8') as written:
+    written.write(content)
+  os.replace(temporary, filename)
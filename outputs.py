@@ -1,31 +1,91 @@
 from abc import ABC, abstractmethod
+from io import BufferedWriter, TextIOWrapper
+from queue import Queue
+from threading import Thread
+import logging
 
 KEY_CSV = 'csv'
 KEY_CSV_FILENAME = 'filename'
+KEY_CSV_BUFFERSIZE = 'buffersize'
 KEY_MYSQL = 'mysql'
 KEY_MYSQL_CONNECTIONINFOS = 'connectioninfos'
 KEY_MYSQL_TABLENAME = 'tablename'
+KEY_MYSQL_BATCHSIZE = 'batchsize'
+KEY_MYSQL_COMMITINTERVAL = 'commitinterval'
+KEY_MYSQL_BULKLOAD = 'bulkload'
+KEY_SQLITE = 'sqlite'
+KEY_SQLITE_FILENAME = 'filename'
+KEY_SQLITE_TABLENAME = 'tablename'
+KEY_SQLITE_BATCHSIZE = 'batchsize'
+KEY_SQLITE_UPSERT = 'upsert'
+KEY_PARQUET = 'parquet'
+KEY_PARQUET_FILENAME = 'filename'
+KEY_PARQUET_ROWGROUPSIZE = 'rowgroupsize'
+KEY_PARQUET_COMPRESSION = 'compression'
 KEY_HTML = 'html'
 KEY_HTML_FILENAME = 'filename'
 KEY_HTML_TITLE = 'title'
 KEY_HTML_SCRIPTS = 'scripts'
 KEY_HTML_STYLES = 'styles'
+KEY_HTML_BUFFERSIZE = 'buffersize'
+DEFAULT_BUFFERSIZE = 65536
+LOGGING_SINK_ERROR = 'output %s error: %s'
+COMPRESSION_GZIP_SUFFIX = '.gz'
+COMPRESSION_ZSTD_SUFFIX = '.zst'
+HTML_ROW_START = """
+      <tr>"""
+HTML_CELL = """
+        <td>%s</td>"""
+HTML_ROW_END = """
+      </tr>"""
+DEFAULT_MYSQL_BATCHSIZE = 500
+MYSQL_BULKLOAD_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+MYSQL_BULKLOAD_NULL = '\\N'
+DEFAULT_SQLITE_BATCHSIZE = 10000
+SQLITE_TYPES = {
+  'string': 'TEXT',
+  'int': 'INTEGER',
+  'float': 'REAL'
+}
+SQLITE_UPSERT_KEYS = ['source', 'link']
+DEFAULT_PARQUET_ROWGROUPSIZE = 65536
+DEFAULT_PARQUET_COMPRESSION = 'zstd'
+PARQUET_TYPES = {
+  'string': 'string',
+  'int': 'int64',
+  'float': 'float64'
+}
+
+def typedoutput(definition):
+  definition.typed = True
+  return definition
 
 DEFAULT_OUTPUT_DEFINITIONS = {
   KEY_CSV: lambda output_config, headers: CsvResultsWriter(output_config, headers),
   KEY_MYSQL: lambda output_config, headers: MySqlResultsWriter(output_config, headers),
+  KEY_SQLITE: typedoutput(lambda output_config, headers, types: SqliteResultsWriter(output_config, headers, types)),
+  KEY_PARQUET: typedoutput(lambda output_config, headers, types: ParquetResultsWriter(output_config, headers, types)),
   KEY_HTML: lambda output_config, headers: HtmlResultsWriter(output_config, headers)
 }
 
 class ResultsWriterFactory:
-  def __init__(self, output_definitions=None):
+  def __init__(self, output_definitions=None, queuesize=0, metrics=None):
     self.output_definitions = output_definitions if output_definitions else DEFAULT_OUTPUT_DEFINITIONS
-  def create(self, outputsconfig, headers):
-    if len(outputsconfig) > 1: return PipelineResultsWriter(outputsconfig, headers, self)
+    self.queuesize = queuesize
+    self.metrics = metrics
+  def create(self, outputsconfig, headers, types=None):
+    if len(outputsconfig) > 1:
+      if self.queuesize: return ThreadedPipelineResultsWriter(outputsconfig, headers, self, types, self.queuesize)
+      return PipelineResultsWriter(outputsconfig, headers, self, types)
     else:
       output_format, output_config = next(output_key for output_key in outputsconfig.items())
       if output_format in self.output_definitions:
-        return self.output_definitions[output_format](output_config, headers)
+        definition = self.output_definitions[output_format]
+        writer = definition(output_config, headers, types) if getattr(definition, 'typed', False) else definition(output_config, headers)
+        if self.metrics:
+          from metrics import STAGE_WRITE
+          writer = TimedResultsWriter(writer, self.metrics.stopwatch(STAGE_WRITE, output_format))
+        return writer
       else: raise KeyError(output_format)
 
 class ResultsWriter(ABC):
@@ -60,54 +120,195 @@ class CsvResultsWriter(ResultsWriter):
   def __init__(self, csvconfig, headers):
     super().__init__(headers)
     self.filename = csvconfig[KEY_CSV_FILENAME]
+    self.buffersize = int(csvconfig[KEY_CSV_BUFFERSIZE]) if KEY_CSV_BUFFERSIZE in csvconfig else DEFAULT_BUFFERSIZE
   def __enter__(self):
-    self.output = open(self.filename, 'w', encoding='utf8')
+    self.output = openoutput(self.filename, self.buffersize)
     self.output.write(','.join(self.headers) + '\n')
     return self
   def __exit__(self, type, value, tb):
     self.output.close()
   def start_item(self, index):
-    self.output.write('%i' % index)
+    self.row = ['%i' % index]
   def write_string(self, value):
-    self.output.write(',"%s"' % value)
+    self.row.append('"%s"' % str(value).replace('"', '""'))
   def write_int(self, value):
-    self.output.write(',%i' % value)
+    self.row.append('%i' % value)
   def write_float(self, value):
-    self.output.write(',%f' % value)
+    self.row.append('%f' % value)
   def write_empty(self):
-    self.output.write(',')
+    self.row.append('')
   def end_item(self):
-    self.output.write('\n')
+    self.output.write(','.join(self.row) + '\n')
 
 class MySqlResultsWriter(ResultsWriter):
   def __init__(self, mysqlconfig, headers):
     super().__init__(headers)
-    self.connectioninfos = mysqlconfig[KEY_MYSQL_CONNECTIONINFOS]
+    self.connectioninfos = dict(mysqlconfig[KEY_MYSQL_CONNECTIONINFOS])
     self.tablename = mysqlconfig[KEY_MYSQL_TABLENAME]
+    self.batchsize = int(mysqlconfig[KEY_MYSQL_BATCHSIZE]) if KEY_MYSQL_BATCHSIZE in mysqlconfig else DEFAULT_MYSQL_BATCHSIZE
+    self.commitinterval = int(mysqlconfig[KEY_MYSQL_COMMITINTERVAL]) if KEY_MYSQL_COMMITINTERVAL in mysqlconfig else self.batchsize
+    self.bulkload = mysqlconfig[KEY_MYSQL_BULKLOAD] if KEY_MYSQL_BULKLOAD in mysqlconfig else False
+    if self.bulkload:
+      self.connectioninfos['allow_local_infile'] = True
   def __enter__(self):
     from mysql.connector import connect
     self.cnn = connect(**self.connectioninfos)
     self.cursor = self.cnn.cursor()
-    columns = ','.join('`%s`' % header for header in self.headers)
+    self.columns = ','.join('`%s`' % header for header in self.headers)
     placeholders = ','.join('%s' for header in self.headers)
-    self.insertion = 'INSERT INTO `%s` (%s) VALUES (%s)' % (self.tablename, columns, placeholders)
+    self.insertion = 'INSERT INTO `%s` (%s) VALUES (%s)' % (self.tablename, self.columns, placeholders)
+    self.batch = []
+    self.uncommitted = 0
+    if self.bulkload:
+      from tempfile import NamedTemporaryFile
+      self.bulkfile = NamedTemporaryFile('w', encoding='utf8', newline='\n', suffix='.tsv', delete=False)
     return self
   def __exit__(self, type, value, tb):
-    self.cursor.close()
-    self.cnn.close()
+    try:
+      if self.bulkload:
+        self.load()
+      else:
+        self.flush()
+        self.commit()
+    finally:
+      self.cursor.close()
+      self.cnn.close()
   def start_item(self, index):
-    self.item_values = (index,)
+    self.item_values = [index]
   def write_string(self, value):
-    self.item_values = self.item_values + (value,)
+    self.item_values.append(value)
   def write_int(self, value):
-    self.item_values = self.item_values + (value,)
+    self.item_values.append(value)
   def write_float(self, value):
-    self.item_values = self.item_values + (value,)
+    self.item_values.append(value)
   def write_empty(self):
-    self.item_values = self.item_values + ('NULL',)
+    self.item_values.append(None)
   def end_item(self):
-    self.cursor.execute(self.insertion, self.item_values)
+    if self.bulkload:
+      self.bulkfile.write('\t'.join(MYSQL_BULKLOAD_NULL if value is None else str(value).translate(MYSQL_BULKLOAD_ESCAPES) for value in self.item_values) + '\n')
+      return
+    self.batch.append(tuple(self.item_values))
+    if len(self.batch) >= self.batchsize:
+      self.flush()
+    if self.uncommitted >= self.commitinterval:
+      self.commit()
+  def flush(self):
+    if not self.batch: return
+    self.cursor.executemany(self.insertion, self.batch)
+    self.uncommitted += len(self.batch)
+    self.batch = []
+  def commit(self):
+    if not self.uncommitted: return
     self.cnn.commit()
+    self.uncommitted = 0
+  def load(self):
+    from os import remove
+    self.bulkfile.close()
+    try:
+      self.cursor.execute("LOAD DATA LOCAL INFILE %%s INTO TABLE `%s` CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (%s)" % (self.tablename, self.columns), (self.bulkfile.name,))
+      self.cnn.commit()
+    finally:
+      remove(self.bulkfile.name)
+
+class SqliteResultsWriter(ResultsWriter):
+  def __init__(self, sqliteconfig, headers, types=None):
+    super().__init__(headers)
+    self.types = types if types else ['string' for header in headers]
+    self.filename = sqliteconfig[KEY_SQLITE_FILENAME]
+    self.tablename = sqliteconfig[KEY_SQLITE_TABLENAME]
+    self.batchsize = int(sqliteconfig[KEY_SQLITE_BATCHSIZE]) if KEY_SQLITE_BATCHSIZE in sqliteconfig else DEFAULT_SQLITE_BATCHSIZE
+    self.upsert = sqliteconfig[KEY_SQLITE_UPSERT] if KEY_SQLITE_UPSERT in sqliteconfig else False
+  def __enter__(self):
+    from sqlite3 import connect
+    self.cnn = connect(self.filename, isolation_level=None)
+    self.cnn.execute('PRAGMA journal_mode=WAL')
+    self.cnn.execute('PRAGMA synchronous=NORMAL')
+    table = sqlitename(self.tablename)
+    columns = [sqlitename(header) for header in self.headers]
+    definitions = ','.join('%s %s' % (column, SQLITE_TYPES[columntype]) for column, columntype in zip(columns, self.types))
+    self.cnn.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (table, definitions))
+    self.insertion = 'INSERT INTO %s (%s) VALUES (%s)' % (table, ','.join(columns), ','.join('?' for column in columns))
+    if self.upsert:
+      keys = ','.join(sqlitename(key) for key in SQLITE_UPSERT_KEYS)
+      self.cnn.execute('CREATE UNIQUE INDEX IF NOT EXISTS %s ON %s (%s)' % (sqlitename('%s_upsert' % self.tablename), table, keys))
+      updates = ','.join('%s=excluded.%s' % (column, column) for column, header in zip(columns, self.headers) if header not in SQLITE_UPSERT_KEYS)
+      self.insertion += ' ON CONFLICT (%s) DO UPDATE SET %s' % (keys, updates)
+    self.batch = []
+    return self
+  def __exit__(self, type, value, tb):
+    try: self.flush()
+    finally: self.cnn.close()
+  def start_item(self, index):
+    self.item_values = [index]
+  def write_string(self, value):
+    self.item_values.append(value)
+  def write_int(self, value):
+    self.item_values.append(value)
+  def write_float(self, value):
+    self.item_values.append(value)
+  def write_empty(self):
+    self.item_values.append(None)
+  def end_item(self):
+    self.batch.append(self.item_values)
+    if len(self.batch) >= self.batchsize:
+      self.flush()
+  def flush(self):
+    if not self.batch: return
+    self.cnn.execute('BEGIN')
+    try:
+      self.cnn.executemany(self.insertion, self.batch)
+    except:
+      self.cnn.execute('ROLLBACK')
+      raise
+    self.cnn.execute('COMMIT')
+    self.batch = []
+
+def sqlitename(name):
+  return '"%s"' % name.replace('"', '""')
+
+class ParquetResultsWriter(ResultsWriter):
+  def __init__(self, parquetconfig, headers, types=None):
+    super().__init__(headers)
+    self.types = types if types else ['string' for header in headers]
+    self.filename = parquetconfig[KEY_PARQUET_FILENAME]
+    self.rowgroupsize = int(parquetconfig[KEY_PARQUET_ROWGROUPSIZE]) if KEY_PARQUET_ROWGROUPSIZE in parquetconfig else DEFAULT_PARQUET_ROWGROUPSIZE
+    self.compression = parquetconfig[KEY_PARQUET_COMPRESSION] if KEY_PARQUET_COMPRESSION in parquetconfig else DEFAULT_PARQUET_COMPRESSION
+  def __enter__(self):
+    import pyarrow
+    from pyarrow.parquet import ParquetWriter
+    self.pyarrow = pyarrow
+    self.schema = pyarrow.schema([(header, getattr(pyarrow, PARQUET_TYPES[columntype])()) for header, columntype in zip(self.headers, self.types)])
+    self.output = ParquetWriter(self.filename, self.schema, compression=self.compression)
+    self.columns = [[] for header in self.headers]
+    self.rows = 0
+    return self
+  def __exit__(self, type, value, tb):
+    try: self.flush()
+    finally: self.output.close()
+  def start_item(self, index):
+    self.column = 0
+    self.append(index)
+  def write_string(self, value):
+    self.append(str(value))
+  def write_int(self, value):
+    self.append(int(value))
+  def write_float(self, value):
+    self.append(float(value))
+  def write_empty(self):
+    self.append(None)
+  def end_item(self):
+    self.rows += 1
+    if self.rows >= self.rowgroupsize:
+      self.flush()
+  def append(self, value):
+    self.columns[self.column].append(value)
+    self.column += 1
+  def flush(self):
+    if not self.rows: return
+    arrays = [self.pyarrow.array(column, type=field.type) for column, field in zip(self.columns, self.schema)]
+    self.output.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema), row_group_size=self.rowgroupsize)
+    self.columns = [[] for header in self.headers]
+    self.rows = 0
 
 class HtmlResultsWriter(ResultsWriter):
   def __init__(self, htmlconfig, headers):
@@ -116,10 +317,11 @@ class HtmlResultsWriter(ResultsWriter):
     self.title = htmlconfig[KEY_HTML_TITLE] if KEY_HTML_TITLE in htmlconfig else None
     self.scripts = htmlconfig[KEY_HTML_SCRIPTS] if KEY_HTML_SCRIPTS in htmlconfig else []
     self.styles = htmlconfig[KEY_HTML_STYLES] if KEY_HTML_STYLES in htmlconfig else []
+    self.buffersize = int(htmlconfig[KEY_HTML_BUFFERSIZE]) if KEY_HTML_BUFFERSIZE in htmlconfig else DEFAULT_BUFFERSIZE
   def __enter__(self):
     htmltitle = ("""
     <title>%s</title>""" % self.title) if self.title else ''
-    self.output = open(self.filename, 'w', encoding='utf8')
+    self.output = openoutput(self.filename, self.buffersize)
     self.output.write("""<!DOCTYPE html>
 <html>
   <head>
@@ -150,31 +352,36 @@ class HtmlResultsWriter(ResultsWriter):
 </html>""")
     self.output.close()
   def start_item(self, index):
-    self.output.write("""
-      <tr>
-        <td>%i</td>""" % index)
+    self.row = [HTML_ROW_START, HTML_CELL % ('%i' % index)]
   def write_string(self, value):
-    self.output.write("""
-        <td>%s</td>""" % str(value).replace('\n', '<br/>'))
+    self.row.append(HTML_CELL % str(value).replace('\n', '<br/>'))
   def write_int(self, value):
-    self.output.write("""
-        <td>%i</td>""" % value)
+    self.row.append(HTML_CELL % ('%i' % value))
   def write_float(self, value):
-    self.output.write("""
-        <td>%f</td>""" % value)
+    self.row.append(HTML_CELL % ('%f' % value))
   def write_empty(self):
-    self.output.write("""
-        <td>&nbsp;</td>""")
+    self.row.append(HTML_CELL % '&nbsp;')
   def end_item(self):
-    self.output.write("""
-      </tr>""")
+    self.row.append(HTML_ROW_END)
+    self.output.write(''.join(self.row))
+
+def openoutput(filename, buffersize):
+  if filename.endswith(COMPRESSION_GZIP_SUFFIX):
+    from gzip import open as opengzip
+    binary = opengzip(filename, 'wb')
+  elif filename.endswith(COMPRESSION_ZSTD_SUFFIX):
+    from zstandard import ZstdCompressor
+    binary = ZstdCompressor().stream_writer(open(filename, 'wb'))
+  else:
+    return open(filename, 'w', encoding='utf8', buffering=buffersize)
+  return TextIOWrapper(BufferedWriter(binary, buffersize), encoding='utf8')
 
 class PipelineResultsWriter(ResultsWriter):
-  def __init__(self, outputsconfig, headers, results_writer_factory):
+  def __init__(self, outputsconfig, headers, results_writer_factory, types=None):
     self.pipeline = []
     for item_format, item_config in outputsconfig.items():
       output_config = { item_format: item_config }
-      self.pipeline.append(results_writer_factory.create(output_config, headers))
+      self.pipeline.append(results_writer_factory.create(output_config, headers, types))
   def __enter__(self):
     for item in self.pipeline:
       item.__enter__()
@@ -200,3 +407,90 @@ class PipelineResultsWriter(ResultsWriter):
   def end_item(self):
     for item in self.pipeline:
       item.end_item()
+
+class ThreadedPipelineResultsWriter(PipelineResultsWriter):
+  def __init__(self, outputsconfig, headers, results_writer_factory, types=None, queuesize=1):
+    super().__init__(outputsconfig, headers, results_writer_factory, types)
+    self.queuesize = queuesize
+  def __enter__(self):
+    self.sinks = [ResultsSink(item, self.queuesize) for item in self.pipeline]
+    for sink in self.sinks:
+      sink.start()
+    return self
+  def __exit__(self, type, value, tb):
+    for sink in self.sinks:
+      sink.close()
+    for sink in self.sinks:
+      sink.join()
+    failed = [sink.error for sink in self.sinks if sink.error]
+    if failed and type is None: raise failed[0]
+  def start_item(self, index):
+    self.row = [('start_item', (index,))]
+  def write_string(self, value):
+    self.row.append(('write_string', (value,)))
+  def write_int(self, value):
+    self.row.append(('write_int', (value,)))
+  def write_float(self, value):
+    self.row.append(('write_float', (value,)))
+  def write_empty(self):
+    self.row.append(('write_empty', ()))
+  def end_item(self):
+    self.row.append(('end_item', ()))
+    for sink in self.sinks:
+      sink.put(self.row)
+
+class TimedResultsWriter(ResultsWriter):
+  def __init__(self, writer, stopwatch):
+    self.writer = writer
+    self.stopwatch = stopwatch
+  def __enter__(self):
+    with self.stopwatch:
+      self.writer.__enter__()
+    return self
+  def __exit__(self, type, value, tb):
+    with self.stopwatch:
+      self.writer.__exit__(type, value, tb)
+  def start_item(self, index):
+    with self.stopwatch:
+      self.writer.start_item(index)
+  def write_string(self, value):
+    with self.stopwatch:
+      self.writer.write_string(value)
+  def write_int(self, value):
+    with self.stopwatch:
+      self.writer.write_int(value)
+  def write_float(self, value):
+    with self.stopwatch:
+      self.writer.write_float(value)
+  def write_empty(self):
+    with self.stopwatch:
+      self.writer.write_empty()
+  def end_item(self):
+    with self.stopwatch:
+      self.writer.end_item()
+
+class ResultsSink(Thread):
+  def __init__(self, writer, queuesize):
+    super().__init__(daemon=True)
+    self.writer = writer
+    self.rows = Queue(queuesize)
+    self.error = None
+  def run(self):
+    row = ()
+    try:
+      with self.writer:
+        row = self.rows.get()
+        while row is not None:
+          for method, args in row:
+            getattr(self.writer, method)(*args)
+          row = self.rows.get()
+    except Exception as exc:
+      self.error = exc
+      logging.exception(LOGGING_SINK_ERROR % (type(self.writer).__name__, str(exc)))
+      while row is not None:
+        row = self.rows.get()
+  def put(self, row):
+    if not self.error:
+      self.rows.put(row)
+  def close(self):
+    self.rows.put(None)
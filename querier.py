@@ -1,20 +1,75 @@
-from lxml import html
-from urllib.parse import urljoin
+from lxml import html, etree
+from re import compile as regex, IGNORECASE
+from urllib.parse import urljoin, urlparse
 from abc import ABC, abstractmethod
+from threading import Condition, Event, Lock, Thread, local
+from queue import Queue, Empty, Full
+from time import monotonic, sleep
+from datetime import timedelta
+from codecs import getincrementaldecoder
+from caches import ContentCache, LruStore, KEY_VALIDATOR_ETAG, KEY_VALIDATOR_LASTMODIFIED, LOGGING_CACHE_STATISTICS
+import logging
 
 KEY_QUERIER_MODE = 'mode'
 KEY_QUERIER_DRIVER = 'driver'
 KEY_QUERIER_ARGSLINE = 'argsline'
 KEY_QUERIER_CACHED = 'cached'
+KEY_QUERIER_CONCURRENCY = 'concurrency'
+KEY_QUERIER_POOLSIZE = 'poolsize'
+KEY_QUERIER_RETRIES = 'retries'
+KEY_QUERIER_BACKOFF = 'backoff'
+KEY_QUERIER_CACHEMEMORY = 'cachememory'
+KEY_QUERIER_CACHETREES = 'cachetrees'
+KEY_QUERIER_LOOKAHEAD = 'lookahead'
+KEY_QUERIER_RECYCLE = 'recycle'
+KEY_QUERIER_BLOCK = 'block'
+KEY_QUERIER_LEAN = 'lean'
+KEY_QUERIER_POLITENESS = 'politeness'
+KEY_POLITENESS_CONCURRENCY = 'concurrency'
+KEY_POLITENESS_RATE = 'rate'
+KEY_POLITENESS_LATENCY = 'latency'
+KEY_POLITENESS_HOSTS = 'hosts'
 KEY_URL = 'url'
 KEY_PAGERS = 'pagers'
 KEY_PAGERS_ACTION = 'action'
 KEY_PAGERS_VALUE = 'value'
+KEY_CONTAINER = 'container'
 QUERIER_PLAIN = 'plain'
 QUERIER_SECURE = 'secure'
 QUERIER_DYNAMIC = 'dynamic'
+DEFAULT_POOLSIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+DEFAULT_CACHEMEMORY = 256 * 1024 * 1024
+CACHE_GET = 'get'
+CACHE_POST = 'post'
+DEFAULT_POLITENESS_CONCURRENCY = 4
+THROTTLING_STATUSES = [429, 503]
+PREFETCH_POLL = 0.1
+DRIVERS_POLL = 0.1
+LEAN_STRIPPED = ['script', 'style']
+LEAN_SNIFF_SIZE = 1024
+LEAN_DECLARED = regex(rb'<meta[^>]+charset|^\s*<\?xml[^>]+encoding', IGNORECASE)
+LEAN_BOMS = [b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff']
+LEAN_FALLBACK_ENCODING = 'cp1252'
+LEAN_DECODE_CHUNK = 65536
+BLOCKED_RESOURCES = {
+  'images': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp'],
+  'fonts': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+  'media': ['*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m4a', '*.avi']
+}
+BLOCKED_PREFERENCES = {
+  'images': ('permissions.default.image', 2),
+  'fonts': ('browser.display.use_document_fonts', 0)
+}
+NAVIGATION_STATUS = "var entries = performance.getEntriesByType('navigation'); return entries.length ? entries[0].responseStatus : null"
+LOGGING_BLOCK_UNSUPPORTED = 'resources %s can\'t be blocked by the %s driver'
 
 class DataQuerier(ABC):
+  observers = ()
+  lookahead = 0
+  lean = False
   @abstractmethod
   def __enter__(self):
     raise NotImplementedError
@@ -27,43 +82,80 @@ class DataQuerier(ABC):
   @abstractmethod
   def post_content(self, link):
     raise NotImplementedError
-  def get(self, link):
-      return html.fromstring(self.get_content(link))
+  def get_validated_content(self, link, validators):
+    return (self.get_content(link), {})
+  def observe(self, observer):
+    self.observers = self.observers + (observer,)
+  def notify(self, link, response):
+    for observer in self.observers:
+      observer(link, response.status_code, response.headers, len(response.content), response.elapsed.total_seconds())
+    return response
+  def get(self, link, container=None):
+      return self.parse(self.get_content(link), container)
   def post(self, link):
-      return html.fromstring(self.post_content(link))
+      return self.parse(self.post_content(link))
+  def parse(self, content, container=None):
+    return parsecontent(content, self.lean, container)
+  def instrument(self, metrics):
+    from metrics import STAGE_PARSE
+    self.observe(metrics.fetched)
+    self.parse = metrics.timed(STAGE_PARSE, 'html', self.parse)
+  def statistics(self):
+    return {}
   def pages(self, scrape_profile):
-    url = scrape_profile[KEY_URL]
-    tree = self.get(url)
-    data = DataQuerier.PageData(tree, self, url)
+    if self.lookahead:
+      return prefetchpages(self.listpages(scrape_profile), self.lookahead)
+    return self.listpages(scrape_profile)
+  def listpages(self, scrape_profile):
+    data = self.page(scrape_profile, scrape_profile[KEY_URL])
     yield data
-    if KEY_PAGERS not in scrape_profile: return
-    pagers_value = scrape_profile[KEY_PAGERS]
-    if isinstance(pagers_value, dict): return
     while True:
-      pagers = tree.xpath(pagers_value)
-      if pagers:
-        url = data.rebase_link(str(pagers[0].attrib['href']))
-        tree = self.get(url)
-        data = DataQuerier.PageData(tree, self, url)
+      url = self.nextpage(scrape_profile, data)
+      if url:
+        data = self.page(scrape_profile, url)
         yield data
       else:
         break
+  def page(self, scrape_profile, url):
+    container = etree.XPath(scrape_profile[KEY_CONTAINER]) if KEY_CONTAINER in scrape_profile else None
+    listing = container
+    if container is not None and KEY_PAGERS in scrape_profile and isinstance(scrape_profile[KEY_PAGERS], str):
+      listing = etree.XPath('(%s) | (%s)' % (scrape_profile[KEY_CONTAINER], scrape_profile[KEY_PAGERS]))
+    return DataQuerier.PageData(self.get(url, listing), self, url, container)
+  def nextpage(self, scrape_profile, data):
+    if KEY_PAGERS not in scrape_profile: return None
+    pagers_value = scrape_profile[KEY_PAGERS]
+    if isinstance(pagers_value, dict): return None
+    pagers = data.xpath(pagers_value)
+    if pagers:
+      return data.rebase_link(str(pagers[0].attrib['href']))
+    return None
   @staticmethod
   def Create(querierconfig):
     mode = querierconfig[KEY_QUERIER_MODE] if KEY_QUERIER_MODE in querierconfig else QUERIER_PLAIN
     cached = querierconfig[KEY_QUERIER_CACHED] if KEY_QUERIER_CACHED in querierconfig else False
     if mode == QUERIER_SECURE: querier = SecureDataQuerier()
-    elif mode == QUERIER_PLAIN: querier = PlainDataQuerier()
+    elif mode == QUERIER_PLAIN: querier = PlainDataQuerier(querierconfig)
     elif mode == QUERIER_DYNAMIC: querier = DynamicDataQuerier(querierconfig)
     else: raise KeyError(mode)
+    if KEY_QUERIER_POLITENESS in querierconfig:
+      querier = PoliteDataQuerier(querier, querierconfig[KEY_QUERIER_POLITENESS])
     if cached:
-      querier = CachedDataQuerier(querier)
+      cachememory = int(querierconfig[KEY_QUERIER_CACHEMEMORY]) if KEY_QUERIER_CACHEMEMORY in querierconfig else DEFAULT_CACHEMEMORY
+      cachetrees = int(querierconfig[KEY_QUERIER_CACHETREES]) if KEY_QUERIER_CACHETREES in querierconfig else 0
+      querier = CachedDataQuerier(querier, ContentCache.Create(cached, cachememory), cachetrees)
+    if KEY_QUERIER_LOOKAHEAD in querierconfig:
+      querier.lookahead = int(querierconfig[KEY_QUERIER_LOOKAHEAD])
+    if KEY_QUERIER_LEAN in querierconfig:
+      querier.lean = querierconfig[KEY_QUERIER_LEAN]
     return querier
   class PageData(object):
-    def __init__(self, tree, querier, url):
+    def __init__(self, tree, querier, url, container=None):
       self.__tree = tree
       self.__querier = querier
       self.__url = url
+      self.url = url
+      self.container = container
     def rebase_link(self, link):
       if link.startswith('#'):
         link = self.__url + link
@@ -71,23 +163,40 @@ class DataQuerier(ABC):
         link = urljoin(self.__url, link)
       return link
     def xpath(self, query):
+      if callable(query): return query(self.__tree)
       return self.__tree.xpath(query)
-    def get(self, link):
-      return html.fromstring(self.__querier.get_content(self.rebase_link(link)))
+    def get(self, link, whole=False):
+      return self.__querier.get(self.rebase_link(link), None if whole else self.container)
+    def get_content(self, link):
+      return self.__querier.get_content(self.rebase_link(link))
 
 class PlainDataQuerier(DataQuerier):
-  def __init__(self):
-    from requests import get, post
-    self.__get = get
-    self.__post = post
+  def __init__(self, querierconfig):
+    concurrency = int(querierconfig[KEY_QUERIER_CONCURRENCY]) if KEY_QUERIER_CONCURRENCY in querierconfig else 1
+    self.poolsize = int(querierconfig[KEY_QUERIER_POOLSIZE]) if KEY_QUERIER_POOLSIZE in querierconfig else max(DEFAULT_POOLSIZE, concurrency)
+    self.retries = int(querierconfig[KEY_QUERIER_RETRIES]) if KEY_QUERIER_RETRIES in querierconfig else DEFAULT_RETRIES
+    self.backoff = float(querierconfig[KEY_QUERIER_BACKOFF]) if KEY_QUERIER_BACKOFF in querierconfig else DEFAULT_BACKOFF
   def __enter__(self):
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+    from urllib3.util import Retry, make_headers
+    retry = Retry(total=self.retries, backoff_factor=self.backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    self.adapter = HTTPAdapter(pool_connections=DEFAULT_POOLSIZE, pool_maxsize=self.poolsize, max_retries=retry)
+    self.request = Session()
+    self.request.headers.update(make_headers(keep_alive=True, accept_encoding=True))
+    self.request.mount('http://', self.adapter)
+    self.request.mount('https://', self.adapter)
+    self.__get = self.request.get
+    self.__post = self.request.post
     return self
   def __exit__(self, type, value, tb):
-    pass
+    self.request.close()
   def get_content(self, link):
-    return self.__get(link).content
+    return self.notify(link, self.__get(link)).content
   def post_content(self, link):
-    return self.__post(link).content
+    return self.notify(link, self.__post(link)).content
+  def get_validated_content(self, link, validators):
+    return validatedcontent(lambda link, headers: self.notify(link, self.__get(link, headers=headers)), link, validators)
 
 class SecureDataQuerier(DataQuerier):
   def __enter__(self):
@@ -112,11 +221,15 @@ class SecureDataQuerier(DataQuerier):
   def get_content(self, link):
     from torpy.guard import GuardState
     if not self.guard or self.guard._state != GuardState.Connected: raise RuntimeError
-    return self.__get(link).content
+    return self.notify(link, self.__get(link)).content
   def post_content(self, link):
     from torpy.guard import GuardState
     if not self.guard or self.guard._state != GuardState.Connected: raise RuntimeError
-    return self.__post(link).content
+    return self.notify(link, self.__post(link)).content
+  def get_validated_content(self, link, validators):
+    from torpy.guard import GuardState
+    if not self.guard or self.guard._state != GuardState.Connected: raise RuntimeError
+    return validatedcontent(lambda link, headers: self.notify(link, self.__get(link, headers=headers)), link, validators)
 
 class DynamicDataQuerier(DataQuerier):
   def __init__(self, querierconfig):
@@ -125,60 +238,355 @@ class DynamicDataQuerier(DataQuerier):
     webdriver = import_module('selenium.webdriver')
     drivername = querierconfig[KEY_QUERIER_DRIVER]
     self.__driverFactory = getattr(webdriver, drivername)
+    self.poolsize = int(querierconfig[KEY_QUERIER_CONCURRENCY]) if KEY_QUERIER_CONCURRENCY in querierconfig else 1
+    self.recycle = int(querierconfig[KEY_QUERIER_RECYCLE]) if KEY_QUERIER_RECYCLE in querierconfig else 0
+    self.blocked = list(querierconfig[KEY_QUERIER_BLOCK]) if KEY_QUERIER_BLOCK in querierconfig else []
     self.__args = None
-    if KEY_QUERIER_ARGSLINE in querierconfig:
+    if KEY_QUERIER_ARGSLINE in querierconfig or self.blocked:
       options = getattr(webdriver, '%sOptions' % drivername)
       self.__args = options()
-      self.__args.add_argument(querierconfig[KEY_QUERIER_ARGSLINE])
+      if KEY_QUERIER_ARGSLINE in querierconfig:
+        self.__args.add_argument(querierconfig[KEY_QUERIER_ARGSLINE])
+      if hasattr(self.__args, 'set_preference'):
+        for resource in self.blocked:
+          if resource in BLOCKED_PREFERENCES: self.__args.set_preference(*BLOCKED_PREFERENCES[resource])
+    if not hasattr(self.__driverFactory, 'execute_cdp_cmd'):
+      unsupported = [resource for resource in self.blocked if resource not in BLOCKED_PREFERENCES or not hasattr(self.__args, 'set_preference')]
+      if unsupported: logging.warning(LOGGING_BLOCK_UNSUPPORTED % (', '.join(unsupported), drivername))
   def __enter__(self):
-    self.__driver = self.__driverFactory(options=self.__args)
+    self.__drivers = Queue()
+    self.__usages = {}
+    self.__created = 0
+    self.__lock = Lock()
     return self
   def __exit__(self, type, value, tb):
-    self.__driver.quit()
+    while not self.__drivers.empty():
+      self.__discard(self.__drivers.get_nowait())
   def get_content(self, link):
-    self.__driver.get(link)
-    return self.__driver.find_element_by_tag_name('html').get_attribute('outerHTML')
+    driver = self.acquire()
+    try:
+      started = monotonic()
+      driver.get(link)
+      return self.__responded(driver, link, started, driver.find_element_by_tag_name('html').get_attribute('outerHTML'))
+    finally:
+      self.release(driver)
   def post_content(self, link):
-    self.__driver.post(link)
-    return self.__driver.find_element_by_tag_name('html').get_attribute('outerHTML')
+    driver = self.acquire()
+    try:
+      started = monotonic()
+      driver.post(link)
+      return self.__responded(driver, link, started, driver.find_element_by_tag_name('html').get_attribute('outerHTML'))
+    finally:
+      self.release(driver)
   def pages(self, scrape_profile):
     if KEY_PAGERS in scrape_profile and isinstance(scrape_profile[KEY_PAGERS], dict):
       url = scrape_profile[KEY_URL]
       pagers_config = scrape_profile[KEY_PAGERS]
       action = pagers_config[KEY_PAGERS_ACTION]
       value = pagers_config[KEY_PAGERS_VALUE]
-      self.__driver.get(url)
-      while True:
-        paging = self.__driver.find_element_by_xpath(value)
-        if paging:
-          getattr(paging, action)()
-        else:
-          break
-      tree = html.fromstring(self.__driver.page_source)
-      yield DataQuerier.PageData(tree, self, url)
+      container = etree.XPath(scrape_profile[KEY_CONTAINER]) if KEY_CONTAINER in scrape_profile else None
+      driver = self.acquire()
+      try:
+        started = monotonic()
+        driver.get(url)
+        while True:
+          paging = driver.find_element_by_xpath(value)
+          if paging:
+            getattr(paging, action)()
+          else:
+            break
+        tree = self.parse(self.__responded(driver, url, started, driver.page_source), container)
+      finally:
+        self.release(driver)
+      yield DataQuerier.PageData(tree, self, url, container)
     else:
       for page in super().pages(scrape_profile):
         yield page
+  def acquire(self):
+    while True:
+      with self.__lock:
+        create = self.__drivers.empty() and self.__created < self.poolsize
+        if create: self.__created += 1
+      if create:
+        try: return self.__create()
+        except:
+          with self.__lock: self.__created -= 1
+          raise
+      try: driver = self.__drivers.get(timeout=DRIVERS_POLL)
+      except Empty: continue
+      if self.healthy(driver): return driver
+      self.__discard(driver)
+  def release(self, driver):
+    with self.__lock:
+      self.__usages[id(driver)] += 1
+      recycled = self.recycle and self.__usages[id(driver)] >= self.recycle
+    if recycled: self.__discard(driver)
+    else: self.__drivers.put(driver)
+  def __responded(self, driver, link, started, content):
+    if self.observers: self.notify(link, DriverResponse(navigationstatus(driver), content, monotonic() - started))
+    return content
+  def healthy(self, driver):
+    try:
+      driver.execute_script('return 1')
+      return True
+    except Exception:
+      return False
+  def __create(self):
+    driver = self.__driverFactory(options=self.__args)
+    if self.blocked and hasattr(driver, 'execute_cdp_cmd'):
+      driver.execute_cdp_cmd('Network.enable', {})
+      driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': [pattern for resource in self.blocked for pattern in BLOCKED_RESOURCES[resource]]})
+    with self.__lock:
+      self.__usages[id(driver)] = 0
+    return driver
+  def __discard(self, driver):
+    with self.__lock:
+      self.__created -= 1
+      self.__usages.pop(id(driver), None)
+    try: driver.quit()
+    except Exception: pass
+
+class DriverResponse(object):
+  def __init__(self, status, content, elapsed):
+    self.status_code = status
+    self.headers = {}
+    self.content = content
+    self.elapsed = timedelta(seconds=elapsed)
 
 class CachedDataQuerier(DataQuerier):
-  def __init__(self, querier):
+  def __init__(self, querier, cache, cachetrees=0):
     self.__querier = querier
-    self.__cached_content = {
-      "get": {},
-      "post": {}
-    }
+    self.__cache = cache
+    self.__trees = LruStore(cachetrees) if cachetrees else None
+    self.__counts = {'hits': 0, 'revalidated': 0, 'misses': 0}
+    self.__lock = Lock()
   def __enter__(self):
     self.__querier.__enter__()
     return self
   def __exit__(self, type, value, tb):
+    self.__cache.close()
+    if self.__trees:
+      logging.info(LOGGING_CACHE_STATISTICS % ('trees', str(self.__trees.statistics())))
     self.__querier.__exit__(type, value, tb)
+  def observe(self, observer):
+    self.__querier.observe(observer)
+  def statistics(self):
+    with self.__lock:
+      statistics = dict(self.__counts)
+    if self.__trees:
+      statistics.update({'trees %s' % key: value for key, value in self.__trees.statistics().items()})
+    return statistics
+  def get(self, link, container=None):
+    if not self.__trees: return super().get(link, container)
+    key = (link, container.path if container is not None else None)
+    tree = self.__trees.get(key)
+    if tree is None:
+      tree = super().get(link, container)
+      self.__trees.put(key, tree)
+    return tree
   def get_content(self, link):
-    cached_content = self.__cached_content["get"]
-    if link not in cached_content:
-      cached_content[link] = self.__querier.get_content(link)
-    return cached_content[link]
+    return self.__fetch(CACHE_GET, link, self.__querier.get_validated_content)
   def post_content(self, link):
-    cached_content = self.__cached_content["post"]
-    if link not in cached_content:
-      cached_content[link] = self.__querier.post_content(link)
-    return cached_content[link]
+    return self.__fetch(CACHE_POST, link, lambda link, validators: (self.__querier.post_content(link), {}))
+  def __fetch(self, method, link, fetcher):
+    cached = self.__cache.lookup(method, link)
+    if cached:
+      content, validators, fresh = cached
+      if fresh:
+        self.__count('hits')
+        return content
+    else:
+      content, validators = None, {}
+    fetched, fetchedvalidators = fetcher(link, validators)
+    if fetched is None:
+      self.__count('revalidated')
+      self.__cache.refresh(method, link)
+      return content
+    self.__count('misses')
+    if fetchedvalidators is not None:
+      self.__cache.store(method, link, fetched, fetchedvalidators)
+    return fetched
+  def __count(self, key):
+    with self.__lock:
+      self.__counts[key] += 1
+
+class PoliteDataQuerier(DataQuerier):
+  def __init__(self, querier, politenessconfig):
+    self.__querier = querier
+    self.__defaults = politenessconfig
+    self.__hosts = politenessconfig[KEY_POLITENESS_HOSTS] if KEY_POLITENESS_HOSTS in politenessconfig else {}
+    self.__schedules = {}
+    self.__lock = Lock()
+    self.__responses = local()
+    querier.observe(self.__responded)
+  def __enter__(self):
+    self.__querier.__enter__()
+    return self
+  def __exit__(self, type, value, tb):
+    self.__querier.__exit__(type, value, tb)
+  def observe(self, observer):
+    self.__querier.observe(observer)
+  def get_content(self, link):
+    return self.__schedule(link, self.__querier.get_content, link)
+  def post_content(self, link):
+    return self.__schedule(link, self.__querier.post_content, link)
+  def get_validated_content(self, link, validators):
+    return self.__schedule(link, self.__querier.get_validated_content, link, validators)
+  def __schedule(self, link, request, *args):
+    schedule = self.__host(urlparse(link).netloc)
+    schedule.acquire()
+    self.__responses.status = None
+    self.__responses.retryafter = None
+    started = monotonic()
+    failed = True
+    try:
+      result = request(*args)
+      failed = False
+      return result
+    finally:
+      schedule.release(monotonic() - started, failed or self.__responses.status in THROTTLING_STATUSES, self.__responses.retryafter)
+  def __host(self, host):
+    with self.__lock:
+      if host not in self.__schedules:
+        hostconfig = self.__hosts[host] if host in self.__hosts else {}
+        setting = lambda key, default: hostconfig[key] if key in hostconfig else self.__defaults[key] if key in self.__defaults else default
+        self.__schedules[host] = HostSchedule(int(setting(KEY_POLITENESS_CONCURRENCY, DEFAULT_POLITENESS_CONCURRENCY)), float(setting(KEY_POLITENESS_RATE, 0)), float(setting(KEY_POLITENESS_LATENCY, 0)))
+      return self.__schedules[host]
+  def __responded(self, link, status, headers, size, elapsed):
+    self.__responses.status = status
+    self.__responses.retryafter = parseretryafter(headers['Retry-After']) if 'Retry-After' in headers else None
+
+class HostSchedule(object):
+  def __init__(self, concurrency, rate, latency):
+    self.concurrency = concurrency
+    self.interval = 1. / rate if rate else 0.
+    self.latency = latency
+    self.window = 1.
+    self.active = 0
+    self.next = 0.
+    self.condition = Condition()
+  def acquire(self):
+    with self.condition:
+      while self.active >= int(self.window):
+        self.condition.wait()
+      self.active += 1
+      now = monotonic()
+      start = max(now, self.next)
+      self.next = start + self.interval
+    if start > now:
+      sleep(start - now)
+  def release(self, elapsed, throttled, retryafter):
+    with self.condition:
+      self.active -= 1
+      if throttled or (self.latency and elapsed > self.latency):
+        self.window = max(1., self.window / 2)
+      else:
+        self.window = min(float(self.concurrency), self.window + 1. / self.window)
+      if retryafter:
+        self.next = max(self.next, monotonic() + retryafter)
+      self.condition.notify_all()
+
+LEAN_PARSERS = local()
+
+def parsecontent(content, lean=False, container=None):
+  if not lean: tree = html.fromstring(content)
+  else:
+    tree = html.fromstring(content, parser=leanparser(content))
+    etree.strip_elements(tree, *LEAN_STRIPPED, with_tail=False)
+  if container is not None: prunetree(tree, container)
+  return tree
+
+def leanparser(content):
+  parsers = LEAN_PARSERS.__dict__
+  encoding = None
+  if isinstance(content, bytes) and not content.isascii() and not content.startswith(tuple(LEAN_BOMS)) and not LEAN_DECLARED.search(content, 0, LEAN_SNIFF_SIZE):
+    encoding = 'utf8' if isutf8(content) else LEAN_FALLBACK_ENCODING
+  if encoding not in parsers:
+    parsers[encoding] = html.HTMLParser(encoding=encoding, remove_comments=True, remove_pis=True)
+  return parsers[encoding]
+
+def isutf8(content):
+  decoder = getincrementaldecoder('utf8')()
+  view = memoryview(content)
+  try:
+    for start in range(0, len(view), LEAN_DECODE_CHUNK):
+      decoder.decode(view[start:start + LEAN_DECODE_CHUNK])
+    decoder.decode(b'', True)
+  except UnicodeDecodeError:
+    return False
+  return True
+
+def prunetree(tree, container):
+  kept = set(element for element in container(tree) if etree.iselement(element))
+  if not kept: return
+  kept = set(element for element in kept if not any(ancestor in kept for ancestor in element.iterancestors()))
+  keptpaths = set(kept)
+  ancestors = []
+  for element in kept:
+    for ancestor in element.iterancestors():
+      if ancestor in keptpaths: break
+      keptpaths.add(ancestor)
+      ancestors.append(ancestor)
+  for ancestor in ancestors:
+    for child in list(ancestor):
+      if child not in keptpaths:
+        ancestor.remove(child)
+
+def navigationstatus(driver):
+  try: return driver.execute_script(NAVIGATION_STATUS) or None
+  except Exception: return None
+
+def parseretryafter(value):
+  try: return float(value)
+  except ValueError: pass
+  from email.utils import parsedate_to_datetime
+  from datetime import datetime, timezone
+  try: return max(0., (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+  except (TypeError, ValueError): return None
+
+def prefetchpages(pages, lookahead):
+  prefetched = Queue(lookahead)
+  stopped = Event()
+  def push(entry):
+    while not stopped.is_set():
+      try:
+        prefetched.put(entry, timeout=PREFETCH_POLL)
+        return True
+      except Full:
+        pass
+    return False
+  def produce():
+    try:
+      for page in pages:
+        if not push((page, None)): return
+    except Exception as exc:
+      push((None, exc))
+      return
+    push((None, None))
+  Thread(target=produce, daemon=True).start()
+  try:
+    while True:
+      page, exc = prefetched.get()
+      if exc: raise exc
+      if page is None: return
+      yield page
+  finally:
+    stopped.set()
+
+def validatedcontent(getter, link, validators):
+  headers = {}
+  if KEY_VALIDATOR_ETAG in validators:
+    headers['If-None-Match'] = validators[KEY_VALIDATOR_ETAG]
+  if KEY_VALIDATOR_LASTMODIFIED in validators:
+    headers['If-Modified-Since'] = validators[KEY_VALIDATOR_LASTMODIFIED]
+  response = getter(link, headers=headers)
+  if response.status_code == 304 and validators:
+    return (None, validators)
+  if not response.ok:
+    return (response.content, None)
+  fetchedvalidators = {}
+  if 'ETag' in response.headers:
+    fetchedvalidators[KEY_VALIDATOR_ETAG] = response.headers['ETag']
+  if 'Last-Modified' in response.headers:
+    fetchedvalidators[KEY_VALIDATOR_LASTMODIFIED] = response.headers['Last-Modified']
+  return (response.content, fetchedvalidators)
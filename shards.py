@@ -0,0 +1,96 @@
+from time import time
+import json
+import logging
+import os
+import socket
+
+KEY_SHARDS_FILENAME = 'filename'
+KEY_SHARDS_WORKERS = 'workers'
+KEY_SHARDS_LEASE = 'lease'
+KEY_SHARDS_SPLIT = 'split'
+UNIT_PENDING = 'pending'
+UNIT_LEASED = 'leased'
+UNIT_DONE = 'done'
+DEFAULT_SHARDS_WORKERS = 1
+DEFAULT_SHARDS_LEASE = 300
+SHARDS_BUSY_TIMEOUT = 60
+SHARDS_POLL = 1
+LOGGING_SHARDS_QUEUED = 'shards queued: %i units'
+LOGGING_SHARDS_RESUMED = 'shards resumed: %i units, %i done'
+LOGGING_SHARDS_CLAIMED = 'shard %s claimed: %s page %i'
+LOGGING_SHARDS_LOST = 'shard %s lost its lease: %s page %i'
+
+class WorkUnit(object):
+  def __init__(self, rank, source, sequence, url):
+    self.rank = rank
+    self.source = source
+    self.sequence = sequence
+    self.url = url
+    self.records = []
+
+class WorkQueue(object):
+  def __init__(self, shardsconfig):
+    self.filename = shardsconfig[KEY_SHARDS_FILENAME]
+    self.workers = int(shardsconfig[KEY_SHARDS_WORKERS]) if KEY_SHARDS_WORKERS in shardsconfig else DEFAULT_SHARDS_WORKERS
+    self.lease = int(shardsconfig[KEY_SHARDS_LEASE]) if KEY_SHARDS_LEASE in shardsconfig else DEFAULT_SHARDS_LEASE
+    self.split = set(shardsconfig[KEY_SHARDS_SPLIT]) if KEY_SHARDS_SPLIT in shardsconfig else set()
+  def __enter__(self):
+    from sqlite3 import connect
+    self.worker = '%s:%i' % (socket.gethostname(), os.getpid())
+    self.cnn = connect(self.filename, timeout=SHARDS_BUSY_TIMEOUT, isolation_level=None)
+    self.cnn.execute('PRAGMA journal_mode=DELETE')
+    self.cnn.execute('CREATE TABLE IF NOT EXISTS units (rank INTEGER, source TEXT, sequence INTEGER, url TEXT, status TEXT, worker TEXT, expires REAL, PRIMARY KEY (source, sequence))')
+    self.cnn.execute('CREATE TABLE IF NOT EXISTS results (source TEXT, sequence INTEGER, position INTEGER, record TEXT, PRIMARY KEY (source, sequence, position))')
+    return self
+  def __exit__(self, type, value, tb):
+    self.cnn.close()
+  def reset(self, units):
+    with self.transaction():
+      self.cnn.execute('DELETE FROM units')
+      self.cnn.execute('DELETE FROM results')
+      self.cnn.executemany('INSERT INTO units VALUES (?, ?, 0, ?, ?, NULL, 0)', [(rank, source, url, UNIT_PENDING) for rank, source, url in units])
+    logging.info(LOGGING_SHARDS_QUEUED % len(units))
+  def resume(self):
+    total, done = self.cnn.execute('SELECT COUNT(*), COUNT(CASE WHEN status = ? THEN 1 END) FROM units', (UNIT_DONE,)).fetchone()
+    if total: logging.info(LOGGING_SHARDS_RESUMED % (total, done))
+    return total > 0
+  def claim(self):
+    with self.transaction():
+      row = self.cnn.execute('SELECT rank, source, sequence, url FROM units WHERE status = ? OR (status = ? AND expires < ?) ORDER BY rank, sequence LIMIT 1', (UNIT_PENDING, UNIT_LEASED, time())).fetchone()
+      if row is None: return None
+      self.cnn.execute('UPDATE units SET status = ?, worker = ?, expires = ? WHERE source = ? AND sequence = ?', (UNIT_LEASED, self.worker, time() + self.lease, row[1], row[2]))
+    unit = WorkUnit(*row)
+    unit.renewed = time()
+    logging.info(LOGGING_SHARDS_CLAIMED % (self.worker, unit.source, unit.sequence))
+    return unit
+  def renew(self, unit):
+    if time() - unit.renewed < self.lease / 2: return
+    unit.renewed = time()
+    self.cnn.execute('UPDATE units SET expires = ? WHERE source = ? AND sequence = ? AND worker = ? AND status = ?', (unit.renewed + self.lease, unit.source, unit.sequence, self.worker, UNIT_LEASED))
+  def add(self, unit, url):
+    self.cnn.execute('INSERT OR IGNORE INTO units VALUES (?, ?, ?, ?, ?, NULL, 0)', (unit.rank, unit.source, unit.sequence + 1, url, UNIT_PENDING))
+  def complete(self, unit):
+    with self.transaction():
+      owned = self.cnn.execute('UPDATE units SET status = ? WHERE source = ? AND sequence = ? AND worker = ? AND status = ?', (UNIT_DONE, unit.source, unit.sequence, self.worker, UNIT_LEASED)).rowcount
+      if owned:
+        self.cnn.execute('DELETE FROM results WHERE source = ? AND sequence = ?', (unit.source, unit.sequence))
+        self.cnn.executemany('INSERT INTO results VALUES (?, ?, ?, ?)', [(unit.source, unit.sequence, position, json.dumps(record)) for position, record in enumerate(unit.records)])
+    if not owned: logging.warning(LOGGING_SHARDS_LOST % (self.worker, unit.source, unit.sequence))
+    return owned > 0
+  def unfinished(self):
+    return self.cnn.execute('SELECT COUNT(*) FROM units WHERE status != ?', (UNIT_DONE,)).fetchone()[0]
+  def results(self):
+    cursor = self.cnn.execute('SELECT r.record FROM results r JOIN units u ON u.source = r.source AND u.sequence = r.sequence ORDER BY u.rank, r.sequence, r.position')
+    for row in cursor:
+      yield json.loads(row[0])
+  def transaction(self):
+    return QueueTransaction(self.cnn)
+
+class QueueTransaction(object):
+  def __init__(self, cnn):
+    self.cnn = cnn
+  def __enter__(self):
+    self.cnn.execute('BEGIN IMMEDIATE')
+    return self
+  def __exit__(self, type, value, tb):
+    self.cnn.execute('COMMIT' if type is None else 'ROLLBACK')
@@ -0,0 +1,59 @@
+from threading import Lock
+from time import time
+import json
+import logging
+
+KEY_INCREMENTAL_FILENAME = 'filename'
+KEY_INCREMENTAL_CHANGEDONLY = 'changedonly'
+STATE_NEW = 'new'
+STATE_CHANGED = 'changed'
+STATE_UNCHANGED = 'unchanged'
+STATE_MISSING = 'missing'
+STATE_COMMIT_INTERVAL = 1000
+STATE_BUSY_TIMEOUT = 60
+STATE_JOURNAL_LOCAL = 'WAL'
+STATE_JOURNAL_SHARED = 'DELETE'
+LOGGING_STATE_STATISTICS = 'incremental statistics: %s'
+
+class ScrapeState(object):
+  def __init__(self, incrementalconfig, shared=False):
+    self.filename = incrementalconfig[KEY_INCREMENTAL_FILENAME]
+    self.commitinterval = 1 if shared else STATE_COMMIT_INTERVAL
+    self.journalmode = STATE_JOURNAL_SHARED if shared else STATE_JOURNAL_LOCAL
+    self.changedonly = incrementalconfig[KEY_INCREMENTAL_CHANGEDONLY] if KEY_INCREMENTAL_CHANGEDONLY in incrementalconfig else False
+    self.statistics = {STATE_NEW: 0, STATE_CHANGED: 0, STATE_UNCHANGED: 0, STATE_MISSING: 0}
+    self.__lock = Lock()
+  def __enter__(self):
+    from sqlite3 import connect
+    self.started = time()
+    self.sources = set()
+    self.uncommitted = 0
+    self.cnn = connect(self.filename, timeout=STATE_BUSY_TIMEOUT, check_same_thread=False)
+    self.cnn.execute('PRAGMA journal_mode=%s' % self.journalmode)
+    self.cnn.execute('CREATE TABLE IF NOT EXISTS items (source TEXT, link TEXT, fingerprint TEXT, record TEXT, seen REAL, PRIMARY KEY (source, link))')
+    return self
+  def __exit__(self, type, value, tb):
+    with self.__lock:
+      for source in self.sources:
+        self.statistics[STATE_MISSING] += self.cnn.execute('SELECT COUNT(*) FROM items WHERE source = ? AND seen < ?', (source, self.started)).fetchone()[0]
+      self.cnn.commit()
+      self.cnn.close()
+    logging.info(LOGGING_STATE_STATISTICS % str(self.statistics))
+  def lookup(self, source, link, fingerprint):
+    with self.__lock:
+      row = self.cnn.execute('SELECT fingerprint, record FROM items WHERE source = ? AND link = ?', (source, link)).fetchone()
+    if row is None: return (STATE_NEW, None)
+    if row[0] != fingerprint: return (STATE_CHANGED, None)
+    return (STATE_UNCHANGED, json.loads(row[1]))
+  def record(self, source, link, fingerprint, record, state):
+    with self.__lock:
+      self.sources.add(source)
+      self.statistics[state] += 1
+      if state == STATE_UNCHANGED:
+        self.cnn.execute('UPDATE items SET seen = ? WHERE source = ? AND link = ?', (time(), source, link))
+      else:
+        self.cnn.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)', (source, link, fingerprint, json.dumps(record), time()))
+      self.uncommitted += 1
+      if self.uncommitted >= self.commitinterval:
+        self.cnn.commit()
+        self.uncommitted = 0